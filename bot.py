@@ -1,11 +1,30 @@
 import asyncio
+import codecs
+import contextvars
+import copy
 import os
+import re
+import random
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
 from datetime import datetime, timedelta
 from typing import List, Dict, Optional
+import atexit
 import logging
+import logging.handlers
+import queue
+import sys
 import json
+import threading
 
 from aiogram import Bot, Dispatcher, types, F
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.client.telegram import PRODUCTION, TelegramAPIServer
+from aiogram.dispatcher.event.bases import UNHANDLED
+from aiogram.exceptions import TelegramBadRequest, TelegramNetworkError, TelegramRetryAfter, TelegramServerError
 from aiogram.filters import Command
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
@@ -14,9 +33,149 @@ from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, CallbackQu
 from aiogram.utils.keyboard import InlineKeyboardBuilder
 
 # ==================== КОНФИГУРАЦИЯ ====================
-BOT_TOKEN = "7078059729:AAG4JvDdzbHV-3ga-LfjEziTA7W3NMmgnZY"
-ADMIN_USERNAME = "JDD452"
-ADMIN_ID = 5138605368
+# Значения по умолчанию. Переопределяются файлом CONFIG_FILE (config.json),
+# а затем переменными окружения с теми же именами
+DEFAULT_CONFIG = {
+    "BOT_TOKEN": "",
+    "ADMIN_USERNAME": "",
+    "ADMIN_ID": 0,
+    
+    # Bot API: свой сервер (например, локальный telegram-bot-api для больших файлов)
+    "API_BASE_URL": "",
+    "API_LOCAL_MODE": False,
+    
+    # HTTP-сессия: размер пула соединений (всего и на хост, 0 - без ограничения),
+    # keep-alive простаивающих соединений в секундах, таймауты запросов
+    "HTTP_POOL_SIZE": 100,
+    "HTTP_POOL_PER_HOST": 0,
+    "HTTP_KEEPALIVE": 75,
+    "HTTP_TIMEOUT": 60,
+    "HTTP_METHOD_TIMEOUTS": {
+        "answerCallbackQuery": 10,
+        "deleteMessage": 10,
+        "editMessageText": 15,
+        "sendMessage": 20,
+        "sendPhoto": 60,
+        "sendVideo": 180,
+        "sendDocument": 120
+    },
+    
+    # Запись входящих апдейтов в JSONL-трассу (для replay.py). Пусто - запись выключена
+    "TRACE_FILE": "",
+    "TRACE_MAX_BYTES": 50 * 1024 * 1024,
+    "TRACE_BACKUPS": 5,
+    
+    # Доля апдейтов, которые замеряет профилировщик (/profile), от 0 до 1
+    "PROFILE_SAMPLE_RATE": 1.0,
+    
+    # Логирование: уровень, файл (пусто - stdout), доля записей по категориям
+    # ("update=0.1,aiogram=0.5") и не чаще одной одинаковой ошибки за LOG_RATE_LIMIT секунд
+    # (окно заметно длиннее минутного тика планировщика, иначе ежеминутный сбой не гасится)
+    "LOG_LEVEL": "INFO",
+    "LOG_FILE": "",
+    "LOG_SAMPLING": "",
+    "LOG_RATE_LIMIT": 600.0,
+    "LOG_QUEUE_SIZE": 10000,
+    
+    # Проверка присланных .txt: максимальный размер, сколько файлов качать одновременно,
+    # сколько вердиктов помнить по file_unique_id
+    "TXT_MAX_BYTES": 2 * 1024 * 1024,
+    "TXT_DOWNLOAD_CONCURRENCY": 4,
+    "TXT_CACHE_SIZE": 5000,
+    
+    # Повторно присланные файлы (по file_unique_id): "reject" - точный повтор отклоняется сразу,
+    # частичный помечается для админа; "flag" - только пометка; "off" - не проверять
+    "DUPLICATE_MODE": "reject",
+    
+    # Уведомления админу: "immediate" - по сообщению на каждый пост и публикацию,
+    # "digest" - одна сводка за DIGEST_WINDOW секунд или по накоплении DIGEST_MAX_ITEMS событий
+    "NOTIFY_MODE": "immediate",
+    "DIGEST_WINDOW": 300,
+    "DIGEST_MAX_ITEMS": 20,
+    
+    # Модераторы: [{"id": 123, "username": "name"}, ...]. Пусто - только ADMIN_ID/ADMIN_USERNAME.
+    # Новые посты раздаются по кругу ("round_robin") или самому свободному ("least_load"),
+    # модератор держит пост CLAIM_LEASE секунд, потом пост передаётся другому
+    "MODERATORS": [],
+    "ASSIGN_MODE": "round_robin",
+    "CLAIM_LEASE": 900,
+    
+    # Сколько раз планировщик пытается допубликовать пост, прежде чем оставить его для /repair
+    "PUBLISH_MAX_ATTEMPTS": 5,
+    
+    # Несколько ботов в одном процессе: [{"name": "cars", "BOT_TOKEN": "...", "ADMIN_ID": 1}, ...].
+    # У каждого свои база (папка DATA_DIR, по умолчанию - имя тенанта), модераторы и каналы;
+    # ключи BOT_TOKEN, ADMIN_*, MODERATORS, ASSIGN_MODE, CLAIM_LEASE, NOTIFY_MODE, DIGEST_*
+    # переопределяют общие. Пусто - один бот из BOT_TOKEN с данными в текущей папке
+    "TENANTS": []
+}
+
+def parse_env_value(value, default):
+    if isinstance(default, bool):
+        return value.strip().lower() in ("1", "true", "yes", "on")
+    if isinstance(default, int):
+        return int(value)
+    if isinstance(default, float):
+        return float(value)
+    if isinstance(default, (dict, list)):
+        return json.loads(value)
+    return value
+
+def load_config():
+    config = dict(DEFAULT_CONFIG)
+    path = os.getenv("CONFIG_FILE", "config.json")
+    if os.path.exists(path):
+        with open(path, "r", encoding="utf-8") as f:
+            config.update(json.load(f))
+    for key, default in DEFAULT_CONFIG.items():
+        value = os.getenv(key)
+        if value is not None:
+            config[key] = parse_env_value(value, default)
+    if isinstance(config["HTTP_METHOD_TIMEOUTS"], dict):
+        config["HTTP_METHOD_TIMEOUTS"] = {**DEFAULT_CONFIG["HTTP_METHOD_TIMEOUTS"], **config["HTTP_METHOD_TIMEOUTS"]}
+    return config
+
+CONFIG = load_config()
+
+def load_tenants():
+    """Настройки каждого бота: общие значения, поверх них - ключи тенанта из TENANTS"""
+    if not CONFIG["TENANTS"]:
+        return [dict(CONFIG, name="", DATA_DIR=".")]
+    tenants = []
+    for i, entry in enumerate(CONFIG["TENANTS"], 1):
+        settings = {**CONFIG, **entry}
+        settings.setdefault("name", f"bot{i}")
+        settings.setdefault("DATA_DIR", settings["name"])
+        tenants.append(settings)
+    return tenants
+
+TENANTS = load_tenants()
+
+TRACE_FILE = CONFIG["TRACE_FILE"]
+TRACE_MAX_BYTES = int(CONFIG["TRACE_MAX_BYTES"])
+TRACE_BACKUPS = int(CONFIG["TRACE_BACKUPS"])
+
+PROFILE_SAMPLE_RATE = float(CONFIG["PROFILE_SAMPLE_RATE"])
+
+LOG_LEVEL = CONFIG["LOG_LEVEL"]
+LOG_FILE = CONFIG["LOG_FILE"]
+LOG_SAMPLING = CONFIG["LOG_SAMPLING"]
+LOG_RATE_LIMIT = float(CONFIG["LOG_RATE_LIMIT"])
+LOG_QUEUE_SIZE = int(CONFIG["LOG_QUEUE_SIZE"])
+
+TXT_MAX_BYTES = int(CONFIG["TXT_MAX_BYTES"])
+TXT_DOWNLOAD_CONCURRENCY = int(CONFIG["TXT_DOWNLOAD_CONCURRENCY"])
+TXT_CACHE_SIZE = int(CONFIG["TXT_CACHE_SIZE"])
+
+DUPLICATE_MODE = CONFIG["DUPLICATE_MODE"]
+
+# Постов на одной странице очереди модерации
+QUEUE_PAGE_SIZE = 5
+
+PUBLISH_MAX_ATTEMPTS = int(CONFIG["PUBLISH_MAX_ATTEMPTS"])
+
+TYPE_NAMES = {'regular': '📤 Обычный пост', 'livery': '👕 Ливрея', 'sticker': '🏷️ Наклейка'}
+TYPE_EMOJI = {'regular': '📤', 'livery': '👕', 'sticker': '🏷️'}
 
 # Лимиты для разных типов постов
 LIMITS = {
@@ -32,8 +191,146 @@ LIMIT_TEXTS = {
     'sticker': "⚠️ Только 1 фото! Нельзя отправить больше 1 фото"
 }
 
-# Настройка логирования
-logging.basicConfig(level=logging.INFO)
+# ==================== ЛОГИРОВАНИЕ ====================
+# Поля текущего апдейта (update_id, user_id, handler), которые попадают в каждую запись
+log_context: ContextVar[Optional[dict]] = ContextVar("log_context", default=None)
+
+LOG_FIELDS = ("category", "tenant", "update_id", "user_id", "handler", "post_id", "duration", "suppressed")
+
+class JsonFormatter(logging.Formatter):
+    """Одна JSON-строка на запись"""
+    def format(self, record):
+        data = {
+            "ts": datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.getMessage()
+        }
+        for field in LOG_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                data[field] = value
+        if record.exc_info:
+            record.exc_text = record.exc_text or self.formatException(record.exc_info)
+        if record.exc_text:
+            data["exc"] = record.exc_text
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+class ContextFilter(logging.Filter):
+    """Выборка и ограничение частоты в потоке вызова; поля апдейта берутся из log_context"""
+    def __init__(self, sampling, rate_limit):
+        super().__init__()
+        self.sampling = sampling
+        self.rate_limit = rate_limit
+        self.last_seen = {}
+        self.pruned_at = time.monotonic()
+    
+    def sample_rate(self, category):
+        while category:
+            if category in self.sampling:
+                return self.sampling[category]
+            category = category.rpartition(".")[0]
+        return 1.0
+    
+    def rate_key(self, record, category):
+        """Одинаковая ошибка - та же категория, пост, шаблон сообщения и тип исключения;
+        текст исключения (секунды retry after, адрес в сетевой ошибке) не учитывается"""
+        error = record.exc_info[0] if record.exc_info else None
+        if error is None and isinstance(record.args, tuple):
+            error = next((type(arg) for arg in record.args if isinstance(arg, BaseException)), None)
+        tenant = current_tenant.get(None)
+        return (category, tenant.name if tenant else None, getattr(record, "post_id", None),
+                record.msg, error.__name__ if error else None)
+    
+    def prune(self, now):
+        # Ключи, окно которых давно истекло, не нужны; пропущенные по ним записи уже не покажутся
+        if now - self.pruned_at >= self.rate_limit:
+            self.last_seen = {key: seen for key, seen in self.last_seen.items() if now - seen[0] < self.rate_limit}
+            self.pruned_at = now
+    
+    def filter(self, record):
+        category = getattr(record, "category", None) or record.name
+        record.category = category
+        
+        if record.levelno < logging.WARNING:
+            rate = self.sample_rate(category)
+            if rate < 1.0 and random.random() >= rate:
+                return False
+        elif self.rate_limit > 0:
+            key = self.rate_key(record, category)
+            now = time.monotonic()
+            seen = self.last_seen.get(key)
+            if seen and now - seen[0] < self.rate_limit:
+                seen[1] += 1
+                return False
+            if seen and seen[1]:
+                record.suppressed = seen[1]
+            self.last_seen[key] = [now, 0]
+            self.prune(now)
+        
+        context = log_context.get()
+        if context:
+            for field, value in context.items():
+                if getattr(record, field, None) is None:
+                    setattr(record, field, value)
+        tenant = current_tenant.get(None)
+        if tenant and tenant.name and getattr(record, "tenant", None) is None:
+            record.tenant = tenant.name
+        return True
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Не ждёт, если очередь переполнена: запись отбрасывается и считается"""
+    dropped = 0
+    
+    def prepare(self, record):
+        # Базовый prepare вклеивает трейсбек в msg и стирает exc_info/exc_text,
+        # здесь он сохраняется в exc_text и попадает в поле "exc" JsonFormatter
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = record.exc_text or logging.Formatter().formatException(record.exc_info)
+        record.exc_info = None
+        return record
+    
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+def parse_sampling(value):
+    sampling = {}
+    for item in value.split(","):
+        if "=" in item:
+            category, rate = item.split("=", 1)
+            sampling[category.strip()] = float(rate)
+    return sampling
+
+def setup_logging():
+    """Запись в stdout/файл идёт в фоновом потоке, обработчики только кладут запись в очередь"""
+    if LOG_FILE:
+        sink = logging.handlers.WatchedFileHandler(LOG_FILE, encoding="utf-8")
+    else:
+        sink = logging.StreamHandler(sys.stdout)
+    sink.setFormatter(JsonFormatter())
+    
+    handler = DroppingQueueHandler(queue.Queue(LOG_QUEUE_SIZE))
+    handler.addFilter(ContextFilter(parse_sampling(LOG_SAMPLING), LOG_RATE_LIMIT))
+    
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(LOG_LEVEL)
+    # aiogram пишет строку на каждый апдейт - вместо неё своя запись "update" с полями
+    logging.getLogger("aiogram.event").setLevel(logging.WARNING)
+    
+    listener = logging.handlers.QueueListener(handler.queue, sink, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener, handler
+
+log_listener, log_handler = setup_logging()
 logger = logging.getLogger(__name__)
 
 # ==================== СОСТОЯНИЯ ====================
@@ -46,70 +343,188 @@ class PostStates(StatesGroup):
     waiting_sticker_file = State()
     confirm_post = State()
 
+# ==================== ЧАСЫ ====================
+class Clock:
+    """Источник времени для обработчиков и планировщика.
+    replay.py и симуляции подменяют его виртуальными часами."""
+    def now(self):
+        return datetime.now()
+    
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+clock = Clock()
+
+# ==================== ТЕНАНТЫ ====================
+# Бот, которому пришёл текущий апдейт (или которого сейчас обходит планировщик)
+current_tenant: ContextVar["Tenant"] = ContextVar("current_tenant")
+
+class TenantLocal:
+    """Объект текущего тенанта под общим именем. Обработчики пишут db.get_post(...)
+    или temp_data[user_id], а попадают в данные того бота, которому пришёл апдейт."""
+    def __init__(self, attr):
+        object.__setattr__(self, "_attr", attr)
+    
+    def _target(self):
+        return getattr(current_tenant.get(), self._attr)
+    
+    def __getattr__(self, name):
+        return getattr(self._target(), name)
+    
+    def __setattr__(self, name, value):
+        setattr(self._target(), name, value)
+    
+    def __getitem__(self, key):
+        return self._target()[key]
+    
+    def __setitem__(self, key, value):
+        self._target()[key] = value
+    
+    def __delitem__(self, key):
+        del self._target()[key]
+    
+    def __contains__(self, key):
+        return key in self._target()
+    
+    def __iter__(self):
+        return iter(self._target())
+    
+    def __len__(self):
+        return len(self._target())
+
+class Tenant:
+    """Один бот со своими базой, модераторами, уведомлениями и незаконченными постами.
+    HTTP-сессия, диспетчер, планировщик и профилировщик общие для всех тенантов."""
+    def __init__(self, settings, session):
+        self.name = settings["name"]
+        self.data_dir = settings["DATA_DIR"]
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.bot = Bot(token=settings["BOT_TOKEN"], session=session)
+        self.db = SimpleDB(self.data_dir)
+        admin = {"id": int(settings["ADMIN_ID"]), "username": settings["ADMIN_USERNAME"]}
+        self.moderators = Moderators(settings["MODERATORS"] or [admin], settings["ASSIGN_MODE"], float(settings["CLAIM_LEASE"]), admin["id"])
+        self.notifier = AdminNotifier(settings["NOTIFY_MODE"], float(settings["DIGEST_WINDOW"]), int(settings["DIGEST_MAX_ITEMS"]))
+        self.temp_data = {}
+        self.temp_channel_add = {}
+        self.publishing_now = set()
+
+@contextmanager
+def use_tenant(tenant):
+    token = current_tenant.set(tenant)
+    try:
+        yield tenant
+    finally:
+        current_tenant.reset(token)
+
 # ==================== ПРОСТАЯ БАЗА ДАННЫХ ====================
 class SimpleDB:
-    def __init__(self):
+    """Горячие данные (посты на модерации и в очереди, каналы) лежат в памяти и в posts.json.
+    Опубликованные посты уходят в архив archive.jsonl, который читается лениво
+    через индекс смещений archive.idx и нужен только статистике и очистке.
+    media.idx - журнал file_unique_id -> id постов для поиска повторов.
+    publish.idx - журнал шагов публикации, сбрасывается при каждом save()."""
+    POSTS_FILE = "posts.json"
+    CHANNELS_FILE = "channels.json"
+    ARCHIVE_FILE = "archive.jsonl"
+    INDEX_FILE = "archive.idx"
+    MEDIA_FILE = "media.idx"
+    PROGRESS_FILE = "publish.idx"
+    
+    def __init__(self, data_dir="."):
+        # У каждого тенанта своя папка с данными
+        for name in ("POSTS_FILE", "CHANNELS_FILE", "ARCHIVE_FILE", "INDEX_FILE", "MEDIA_FILE", "PROGRESS_FILE"):
+            setattr(self, name, os.path.join(data_dir, getattr(self, name)))
         self.posts = []
         self.channels = []
         self.current_channel = None
+        self.next_id = 1
+        self.moderator_stats = {}
+        self._index = None
+        self._media = None
+        self._media_posts = None
         self.load()
     
     def load(self):
         try:
-            if os.path.exists("posts.json"):
-                with open("posts.json", "r") as f:
+            if os.path.exists(self.POSTS_FILE):
+                with open(self.POSTS_FILE, "r") as f:
                     self.posts = json.load(f)
         except:
             self.posts = []
         
         try:
-            if os.path.exists("channels.json"):
-                with open("channels.json", "r") as f:
+            if os.path.exists(self.CHANNELS_FILE):
+                with open(self.CHANNELS_FILE, "r") as f:
                     data = json.load(f)
                     self.channels = data.get("channels", [])
                     self.current_channel = data.get("current_channel")
+                    self.next_id = data.get("next_id", 1)
+                    self.moderator_stats = data.get("moderator_stats", {})
         except:
             self.channels = []
-    
+        
+        self.next_id = max([self.next_id] + [p["id"] + 1 for p in self.posts] + [self._last_archived_id() + 1])
+        
+        # posts.json старого формата хранил и опубликованные посты
+        published = [p for p in self.posts if p["status"] == "published"]
+        if published:
+            self._append_archive(published)
+            self.posts = [p for p in self.posts if p["status"] != "published"]
+            self.save()
+        
+        self._replay_progress()
+
     def save(self):
         try:
-            with open("posts.json", "w") as f:
+            with open(self.POSTS_FILE, "w") as f:
                 json.dump(self.posts, f, indent=2)
-            with open("channels.json", "w") as f:
+            with open(self.CHANNELS_FILE, "w") as f:
                 json.dump({
                     "channels": self.channels,
-                    "current_channel": self.current_channel
+                    "current_channel": self.current_channel,
+                    "next_id": self.next_id,
+                    "moderator_stats": self.moderator_stats
                 }, f, indent=2)
+            # Шаги публикации теперь лежат в posts.json
+            if os.path.exists(self.PROGRESS_FILE):
+                os.remove(self.PROGRESS_FILE)
         except Exception as e:
-            logger.error(f"Ошибка сохранения: {e}")
+            logger.error("Ошибка сохранения: %s", e, extra={"category": "db"})
     
     def add_post(self, user_id, username, content):
-        post_id = len(self.posts) + 1
+        post_id = self.next_id
+        self.next_id += 1
         post = {
             "id": post_id,
             "user_id": user_id,
             "username": username,
             "content": content,
             "status": "pending",
-            "created_at": datetime.now().isoformat(),
+            "created_at": clock.now().isoformat(),
             "channel": self.current_channel
         }
         self.posts.append(post)
         self.save()
+        self._index_media(post_id, content.get("unique_ids", []))
         return post_id
     
     def get_pending_posts(self):
         return [p for p in self.posts if p["status"] == "pending"]
     
+    def get_unfinished_posts(self):
+        """Одобренные посты, публикация которых начиналась или падала"""
+        return [p for p in self.posts if p["status"] == "approved"
+                and (p.get("publish_progress") or p.get("publish_attempts"))]
+    
     def get_post(self, post_id):
         for p in self.posts:
             if p["id"] == post_id:
                 return p
-        return None
+        return self.get_archived_post(post_id)
     
     def approve_post(self, post_id, scheduled_time=None):
         post = self.get_post(post_id)
-        if post:
+        if post and post["status"] != "published":
             post["status"] = "approved"
             post["scheduled_time"] = scheduled_time
             self.save()
@@ -117,6 +532,198 @@ class SimpleDB:
     def delete_post(self, post_id):
         self.posts = [p for p in self.posts if p["id"] != post_id]
         self.save()
+        self._unindex_media({post_id})
+    
+    def prune_posts(self, cutoff):
+        """Удаляет посты на модерации и в очереди, созданные раньше cutoff. Возвращает число удалённых"""
+        removed = {p["id"] for p in self.posts if datetime.fromisoformat(p["created_at"]) <= cutoff}
+        if removed:
+            self.posts = [p for p in self.posts if p["id"] not in removed]
+            self.save()
+            self._unindex_media(removed)
+        return len(removed)
+    
+    def find_duplicates(self, unique_ids):
+        """{id поста: сколько из unique_ids в нём уже есть}"""
+        media = self._get_media()
+        matches = {}
+        for unique_id in set(unique_ids):
+            for post_id in media.get(unique_id, ()):
+                matches[post_id] = matches.get(post_id, 0) + 1
+        return matches
+    
+    def exact_duplicates(self, unique_ids, duplicates):
+        """Посты из find_duplicates с точно тем же набором файлов: не подмножество и не надмножество"""
+        wanted = len(set(unique_ids))
+        self._get_media()
+        return [post_id for post_id, count in duplicates.items()
+                if count == wanted and len(self._media_posts.get(post_id, ())) == wanted]
+    
+    # ---------- архив опубликованных ----------
+    def archive_post(self, post):
+        self.archive_posts([post])
+    
+    def archive_posts(self, posts):
+        """Переносит опубликованные посты в архив: одна запись в файлы, один проход по posts и одно сохранение"""
+        if not posts:
+            return
+        for post in posts:
+            post["status"] = "published"
+        self._append_archive(posts)
+        archived = {post["id"] for post in posts}
+        self.posts = [p for p in self.posts if p["id"] not in archived]
+        self.save()
+    
+    def get_archived_post(self, post_id):
+        entry = self._get_index().get(post_id)
+        if not entry:
+            return None
+        offset, length, _ = entry
+        with open(self.ARCHIVE_FILE, "rb") as f:
+            f.seek(offset)
+            return json.loads(f.read(length))
+    
+    def archived_count(self):
+        return len(self._get_index())
+    
+    def clear_archive(self):
+        archived = set(self._get_index())
+        removed = len(archived)
+        self._unindex_media(archived)
+        for path in (self.ARCHIVE_FILE, self.INDEX_FILE):
+            if os.path.exists(path):
+                os.remove(path)
+        self._index = {}
+        return removed
+    
+    def prune_archive(self, cutoff):
+        """Удаляет из архива посты, созданные раньше cutoff. Возвращает число удалённых"""
+        index = self._get_index()
+        keep = {post_id: entry for post_id, entry in index.items()
+                if datetime.fromisoformat(entry[2]) > cutoff}
+        removed = len(index) - len(keep)
+        if not removed:
+            return 0
+        self._unindex_media(set(index) - set(keep))
+        
+        new_index = {}
+        with open(self.ARCHIVE_FILE, "rb") as src, \
+                open(self.ARCHIVE_FILE + ".tmp", "wb") as dst, \
+                open(self.INDEX_FILE + ".tmp", "w") as idx:
+            for post_id, (offset, length, created_at) in sorted(keep.items(), key=lambda x: x[1][0]):
+                src.seek(offset)
+                new_offset = dst.tell()
+                dst.write(src.read(length))
+                idx.write(f"{post_id}\t{new_offset}\t{length}\t{created_at}\n")
+                new_index[post_id] = (new_offset, length, created_at)
+        os.replace(self.ARCHIVE_FILE + ".tmp", self.ARCHIVE_FILE)
+        os.replace(self.INDEX_FILE + ".tmp", self.INDEX_FILE)
+        self._index = new_index
+        return removed
+    
+    def _append_archive(self, posts):
+        entries = []
+        with open(self.ARCHIVE_FILE, "ab") as f:
+            offset = f.seek(0, os.SEEK_END)
+            for post in posts:
+                line = (json.dumps(post, ensure_ascii=False) + "\n").encode("utf-8")
+                f.write(line)
+                entries.append((post["id"], offset, len(line), post["created_at"]))
+                offset += len(line)
+        with open(self.INDEX_FILE, "a") as f:
+            f.writelines(f"{post_id}\t{offset}\t{length}\t{created_at}\n" for post_id, offset, length, created_at in entries)
+        if self._index is not None:
+            for post_id, offset, length, created_at in entries:
+                self._index[post_id] = (offset, length, created_at)
+    
+    def _get_index(self):
+        if self._index is None:
+            if os.path.exists(self.ARCHIVE_FILE) and not os.path.exists(self.INDEX_FILE):
+                self._rebuild_index()
+            self._index = {}
+            if os.path.exists(self.INDEX_FILE):
+                with open(self.INDEX_FILE, "r") as f:
+                    for line in f:
+                        post_id, offset, length, created_at = line.rstrip("\n").split("\t")
+                        self._index[int(post_id)] = (int(offset), int(length), created_at)
+        return self._index
+    
+    def _rebuild_index(self):
+        with open(self.ARCHIVE_FILE, "rb") as src, open(self.INDEX_FILE, "w") as idx:
+            offset = 0
+            for line in src:
+                post = json.loads(line)
+                idx.write(f"{post['id']}\t{offset}\t{len(line)}\t{post['created_at']}\n")
+                offset += len(line)
+    
+    # ---------- индекс повторов ----------
+    def _get_media(self):
+        if self._media is None:
+            self._media = {}
+            self._media_posts = {}
+            if os.path.exists(self.MEDIA_FILE):
+                with open(self.MEDIA_FILE, "r") as f:
+                    for line in f:
+                        op, *args = line.rstrip("\n").split("\t")
+                        if op == "+":
+                            self._add_media(int(args[0]), args[1:])
+                        elif op == "-":
+                            self._remove_media(int(post_id) for post_id in args)
+        return self._media
+    
+    def _add_media(self, post_id, unique_ids):
+        self._media_posts[post_id] = unique_ids
+        for unique_id in unique_ids:
+            self._media.setdefault(unique_id, []).append(post_id)
+    
+    def _remove_media(self, post_ids):
+        for post_id in post_ids:
+            for unique_id in self._media_posts.pop(post_id, ()):
+                posts = self._media.get(unique_id, [])
+                if post_id in posts:
+                    posts.remove(post_id)
+                if not posts:
+                    self._media.pop(unique_id, None)
+    
+    def _index_media(self, post_id, unique_ids):
+        if not unique_ids:
+            return
+        self._get_media()
+        unique_ids = list(dict.fromkeys(unique_ids))
+        self._add_media(post_id, unique_ids)
+        with open(self.MEDIA_FILE, "a") as f:
+            f.write("\t".join(["+", str(post_id)] + unique_ids) + "\n")
+    
+    def _unindex_media(self, post_ids):
+        self._get_media()
+        post_ids = [post_id for post_id in post_ids if post_id in self._media_posts]
+        if not post_ids:
+            return
+        self._remove_media(post_ids)
+        # Журнал переписывается целиком, только если удалений стало много
+        if len(post_ids) > 100:
+            with open(self.MEDIA_FILE + ".tmp", "w") as f:
+                for post_id, unique_ids in self._media_posts.items():
+                    f.write("\t".join(["+", str(post_id)] + unique_ids) + "\n")
+            os.replace(self.MEDIA_FILE + ".tmp", self.MEDIA_FILE)
+        else:
+            with open(self.MEDIA_FILE, "a") as f:
+                f.write("\t".join(["-"] + [str(post_id) for post_id in post_ids]) + "\n")
+    
+    def _last_archived_id(self):
+        """Наибольший id в хвосте индекса, без чтения всего файла (для баз без next_id)"""
+        if not os.path.exists(self.INDEX_FILE):
+            if os.path.exists(self.ARCHIVE_FILE):
+                self._rebuild_index()
+            else:
+                return 0
+        with open(self.INDEX_FILE, "rb") as f:
+            start = max(0, f.seek(0, os.SEEK_END) - 4096)
+            f.seek(start)
+            lines = f.read().splitlines()
+        if start:
+            lines = lines[1:]  # первая строка может быть обрезана
+        return max((int(line.split(b"\t")[0]) for line in lines if line), default=0)
     
     def add_channel(self, channel_id, title=None):
         for ch in self.channels:
@@ -145,22 +752,434 @@ class SimpleDB:
                 return True
         return False
     
+    # ---------- журнал публикации ----------
+    def record_progress(self, post, kind, message_id):
+        """Отмечает шаг публикации дописыванием строки в журнал, без перезаписи posts.json"""
+        progress = post.setdefault('publish_progress', [])
+        self._append_progress(f"{post['id']}\t{len(progress)}\t{kind}\t{message_id}\n")
+        progress.append({"step": kind, "message_id": message_id})
+    
+    def _append_progress(self, line):
+        with open(self.PROGRESS_FILE, "a") as f:
+            f.write(line)
+    
+    def _replay_progress(self):
+        """Догоняет посты из posts.json шагами, записанными после последнего save()"""
+        if not os.path.exists(self.PROGRESS_FILE):
+            return
+        posts = {p["id"]: p for p in self.posts}
+        with open(self.PROGRESS_FILE, "r") as f:
+            for line in f:
+                try:
+                    post_id, step, kind, message_id = line.rstrip("\n").split("\t")
+                except ValueError:
+                    continue  # строка, недописанная при сбое
+                post = posts.get(int(post_id))
+                if post is None:
+                    continue
+                progress = post.setdefault('publish_progress', [])
+                if len(progress) == int(step):
+                    progress.append({"step": kind, "message_id": int(message_id)})
+    
+    def get_channel(self, channel_id):
+        for ch in self.channels:
+            if ch["id"] == channel_id:
+                return ch
+        return None
+    
     def get_current_channel(self):
         for ch in self.channels:
             if ch["id"] == self.current_channel:
                 return ch
         return None
 
-db = SimpleDB()
+db = TenantLocal("db")
 
 # ==================== ИНИЦИАЛИЗАЦИЯ ====================
-bot = Bot(token=BOT_TOKEN)
+class TunedSession(AiohttpSession):
+    """aiohttp-сессия с настраиваемым пулом соединений, keep-alive и таймаутами по методам"""
+    def __init__(self, pool_size, pool_per_host, keepalive, method_timeouts, **kwargs):
+        super().__init__(**kwargs)
+        self._connector_init.update(
+            limit=pool_size,
+            limit_per_host=pool_per_host,
+            keepalive_timeout=keepalive,
+            ttl_dns_cache=300
+        )
+        self.method_timeouts = method_timeouts
+    
+    async def make_request(self, bot, method, timeout=None):
+        if timeout is None:
+            timeout = self.method_timeouts.get(method.__api_method__)
+        return await super().make_request(bot, method, timeout)
+
+def create_session():
+    if CONFIG["API_BASE_URL"]:
+        api = TelegramAPIServer.from_base(CONFIG["API_BASE_URL"], is_local=bool(CONFIG["API_LOCAL_MODE"]))
+    else:
+        api = PRODUCTION
+    return TunedSession(
+        pool_size=int(CONFIG["HTTP_POOL_SIZE"]),
+        pool_per_host=int(CONFIG["HTTP_POOL_PER_HOST"]),
+        keepalive=float(CONFIG["HTTP_KEEPALIVE"]),
+        method_timeouts=CONFIG["HTTP_METHOD_TIMEOUTS"],
+        api=api,
+        timeout=float(CONFIG["HTTP_TIMEOUT"])
+    )
+
+def check_tenant(settings):
+    """Текст ошибки в настройках бота или None"""
+    name = f" ({settings['name']})" if settings["name"] else ""
+    if not settings["BOT_TOKEN"]:
+        return f"BOT_TOKEN не задан{name}: укажите его в config.json или в переменной окружения BOT_TOKEN"
+    try:
+        admin_id = int(settings["ADMIN_ID"])
+    except (TypeError, ValueError):
+        admin_id = 0
+    if not admin_id:
+        return f"ADMIN_ID не задан{name}: укажите числовой id администратора в config.json или в переменной окружения ADMIN_ID"
+    for moderator in settings["MODERATORS"]:
+        if not isinstance(moderator, dict) or not isinstance(moderator.get("id"), int):
+            return f"MODERATORS{name}: у каждого модератора нужен числовой id, получено {moderator!r}"
+    return None
+
+for settings in TENANTS:
+    error = check_tenant(settings)
+    if error:
+        sys.exit(error)
+
+# Одна сессия (пул соединений) на все боты процесса
+session = create_session()
+bot = TenantLocal("bot")
+# Ключи FSM включают id бота, поэтому состояния тенантов не пересекаются
 storage = MemoryStorage()
 dp = Dispatcher(storage=storage)
+tenants = []
+tenants_by_bot = {}
+
+@dp.update.outer_middleware()
+async def select_tenant(handler, event, data):
+    with use_tenant(tenants_by_bot[data["bot"].id]):
+        return await handler(event, data)
+
+# ==================== КОНТЕКСТ ЛОГОВ ====================
+@dp.update.outer_middleware()
+async def log_updates(handler, event, data):
+    user = data.get("event_from_user")
+    context = {"update_id": event.update_id, "user_id": user.id if user else None}
+    token = log_context.set(context)
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        context["duration"] = round(time.perf_counter() - started, 4)
+        logger.info("update", extra={"category": "update"})
+        log_context.reset(token)
+
+async def log_handler_name(handler, event, data):
+    context = log_context.get()
+    if context is not None:
+        context["handler"] = data["handler"].callback.__name__
+    return await handler(event, data)
+
+dp.message.middleware(log_handler_name)
+dp.callback_query.middleware(log_handler_name)
+
+# ==================== ТРАССИРОВКА ====================
+# Методы Bot API, вызванные при обработке текущего апдейта
+current_calls: ContextVar[Optional[list]] = ContextVar("current_calls", default=None)
+
+class TraceWriter:
+    """JSONL-трасса апдейтов с ротацией по размеру (trace.jsonl, trace.jsonl.1, ...).
+    Запись и ротация идут в фоновом потоке, обработчики только кладут запись в очередь;
+    если очередь переполнена, запись отбрасывается и считается."""
+    def __init__(self, path, max_bytes, backups, queue_size):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.file = open(path, "a", encoding="utf-8")
+        self.size = self.file.tell()
+        self.queue = queue.Queue(queue_size)
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name="trace-writer", daemon=True)
+        self.thread.start()
+        atexit.register(self.stop)
+    
+    def write(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+    
+    def run(self):
+        while True:
+            record = self.queue.get()
+            if record is None:
+                break
+            try:
+                self.write_line(json.dumps(record, ensure_ascii=False) + "\n")
+            except Exception as e:
+                logger.error("Ошибка записи трассы: %s", e, extra={"category": "trace"})
+        self.file.close()
+    
+    def stop(self):
+        self.queue.put(None)
+        self.thread.join()
+    
+    def write_line(self, line):
+        if self.size and self.size + len(line) > self.max_bytes:
+            self.rotate()
+        self.file.write(line)
+        self.file.flush()
+        self.size += len(line)
+    
+    def rotate(self):
+        self.file.close()
+        for i in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{i}"):
+                os.replace(f"{self.path}.{i}", f"{self.path}.{i + 1}")
+        if self.backups > 0:
+            os.replace(self.path, f"{self.path}.1")
+        else:
+            os.remove(self.path)
+        self.file = open(self.path, "a", encoding="utf-8")
+        self.size = 0
+
+class CallRecorder(BaseRequestMiddleware):
+    """Запоминает, какие методы Bot API вызвал обработчик апдейта"""
+    async def __call__(self, make_request, bot, method):
+        calls = current_calls.get()
+        if calls is not None:
+            calls.append(method.__api_method__)
+        return await make_request(bot, method)
+
+trace_writer = TraceWriter(TRACE_FILE, TRACE_MAX_BYTES, TRACE_BACKUPS, LOG_QUEUE_SIZE) if TRACE_FILE else None
+session.middleware(CallRecorder())
+
+# Сколько записей логов и трассы уже отброшено (и показано в report_dropped)
+reported_drops = (0, 0)
+
+def report_dropped():
+    """Пишет предупреждение, если с прошлого раза очереди логов или трассы переполнялись.
+    Зовётся раз в тик планировщика и при остановке"""
+    global reported_drops
+    dropped = (log_handler.dropped, trace_writer.dropped if trace_writer else 0)
+    if dropped != reported_drops:
+        logger.warning("Очередь переполнена, отброшено записей: логов %s, трассы %s (всего %s и %s)",
+                       dropped[0] - reported_drops[0], dropped[1] - reported_drops[1], *dropped,
+                       extra={"category": "logging"})
+        reported_drops = dropped
+
+@dp.update.outer_middleware()
+async def trace_updates(handler, event, data):
+    # replay.py выставляет свой список заранее, чтобы сравнить вызовы с трассой
+    calls = current_calls.get()
+    if calls is None:
+        calls = []
+    token = current_calls.set(calls)
+    # Время прихода, а не завершения: апдейты обрабатываются параллельно,
+    # и replay.py восстанавливает по этим отметкам порядок и интервалы
+    arrived = time.time()
+    arrived_clock = clock.now()
+    started = time.perf_counter()
+    error = None
+    result = UNHANDLED
+    try:
+        result = await handler(event, data)
+        return result
+    except Exception as e:
+        error = repr(e)
+        raise
+    finally:
+        current_calls.reset(token)
+        if trace_writer:
+            try:
+                trace_writer.write({
+                    "ts": arrived,
+                    "clock": arrived_clock.isoformat(),
+                    "bot": data["bot"].id,
+                    "update": event.model_dump(mode="json", exclude_none=True),
+                    "handled": result is not UNHANDLED,
+                    "calls": calls,
+                    "error": error,
+                    "duration": time.perf_counter() - started
+                })
+            except Exception as e:
+                logger.error("Ошибка записи трассы: %s", e, extra={"category": "trace"})
+
+# ==================== ПРОФИЛИРОВАНИЕ ====================
+# Накопленное ожидание Bot API (в секундах) для замеряемого обработчика
+api_wait: ContextVar[Optional[list]] = ContextVar("api_wait", default=None)
+
+class Profiler:
+    """Профилирование по запросу (/profile): время обработчиков, методов SimpleDB и Bot API.
+    Пока выключен, обёртки проверяют только флаг active."""
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.active = False
+        self.stats = {}
+        self.chat_id = None
+        self.tenant = None
+        self.started = None
+        self.remaining = None
+        self.updates = 0
+        self.timer = None
+        self.db_originals = {}
+        self.db_depth = 0
+    
+    def start(self, chat_id, seconds=None, updates=None):
+        self.stats = {}
+        self.chat_id = chat_id
+        self.tenant = current_tenant.get()
+        self.started = time.perf_counter()
+        self.remaining = updates
+        self.updates = 0
+        self.wrap_db()
+        self.active = True
+        if seconds:
+            self.timer = asyncio.create_task(self.stop_after(seconds))
+    
+    async def stop_after(self, seconds):
+        await asyncio.sleep(seconds)
+        self.timer = None
+        await self.finish()
+    
+    def wrap_db(self):
+        for name, method in list(vars(SimpleDB).items()):
+            if name.startswith("_") or not callable(method):
+                continue
+            self.db_originals[name] = method
+            setattr(SimpleDB, name, self.timed(f"db.{name}", method))
+    
+    def unwrap_db(self):
+        for name, method in self.db_originals.items():
+            setattr(SimpleDB, name, method)
+        self.db_originals = {}
+    
+    def timed(self, label, method):
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            self.db_depth += 1
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.db_depth -= 1
+                elapsed = time.perf_counter() - started
+                self.record(label, elapsed, 0.0)
+                # db.* - время SimpleDB без двойного счёта вложенных вызовов
+                if not self.db_depth:
+                    self.record("db.*", elapsed, 0.0)
+        return wrapper
+    
+    def record(self, name, wall, api):
+        entry = self.stats.setdefault(name, [0, 0.0, 0.0, 0.0])
+        entry[0] += 1
+        entry[1] += wall
+        entry[2] = max(entry[2], wall)
+        entry[3] += api
+    
+    async def run(self, name, func, *args, update=False):
+        if not self.active or random.random() >= self.sample_rate:
+            return await func(*args)
+        waits = [0.0]
+        token = api_wait.set(waits)
+        started = time.perf_counter()
+        try:
+            return await func(*args)
+        finally:
+            api_wait.reset(token)
+            self.record(name, time.perf_counter() - started, waits[0])
+            if update:
+                self.updates += 1
+                if self.remaining is not None:
+                    self.remaining -= 1
+                    if self.remaining <= 0 and self.active:
+                        asyncio.create_task(self.send_report(*self.stop()))
+    
+    def report(self, stats):
+        """Время cumtime включает вложенные вызовы: archive_post -> archive_posts -> save
+        считается на каждом уровне. Строка db.* - всё время SimpleDB без повторов"""
+        lines = [f"{'name':<40}{'ncalls':>8}{'cumtime':>10}{'percall':>10}{'max':>10}{'api':>10}{'cpu':>10}"]
+        for name, (count, wall, longest, api) in sorted(stats.items(), key=lambda x: -x[1][1]):
+            lines.append(f"{name:<40}{count:>8}{wall:>10.3f}{wall / count:>10.4f}{longest:>10.3f}{api:>10.3f}{wall - api:>10.3f}")
+        return "\n".join(lines)
+    
+    def stop(self):
+        """Снимает обёртки SimpleDB сразу, без await: новый /profile может начаться
+        до отправки отчёта и не должен принять обёртки за исходные методы.
+        Возвращает собранное для send_report"""
+        self.active = False
+        if self.timer:
+            self.timer.cancel()
+            self.timer = None
+        self.unwrap_db()
+        return self.stats, time.perf_counter() - self.started, self.updates, self.chat_id, self.tenant
+    
+    async def finish(self):
+        await self.send_report(*self.stop())
+    
+    async def send_report(self, stats, elapsed, updates, chat_id, tenant):
+        path = f"profile_{datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
+        try:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(f"# {elapsed:.1f} s, updates: {updates}, sample rate: {self.sample_rate}\n")
+                f.write(self.report(stats) + "\n")
+        except Exception as e:
+            logger.error("Ошибка записи профиля: %s", e, extra={"category": "profile"})
+        
+        handlers = sorted(
+            ((name, entry) for name, entry in stats.items() if not name.startswith(("db.", "api."))),
+            key=lambda x: -x[1][1]
+        )
+        text = f"📈 Профиль за {elapsed:.0f} с, апдейтов: {updates}\n📁 {path}\n\n"
+        for name, (count, wall, longest, api) in handlers[:10]:
+            text += f"{name}: {count}× ср. {wall / count * 1000:.0f} мс, API {api / wall * 100 if wall else 0:.0f}%\n"
+        db_total = stats.get("db.*", [0, 0.0])[1]
+        text += f"\n💾 SimpleDB: {db_total * 1000:.0f} мс"
+        try:
+            await tenant.bot.send_message(chat_id, text)
+        except Exception as e:
+            logger.error("Ошибка отправки профиля: %s", e, extra={"category": "profile"})
+
+class ApiTimer(BaseRequestMiddleware):
+    """Засекает ожидание Bot API для обработчика, который сейчас профилируется"""
+    async def __call__(self, make_request, bot, method):
+        waits = api_wait.get()
+        if waits is None:
+            return await make_request(bot, method)
+        started = time.perf_counter()
+        try:
+            return await make_request(bot, method)
+        finally:
+            elapsed = time.perf_counter() - started
+            waits[0] += elapsed
+            profiler.record(f"api.{method.__api_method__}", elapsed, elapsed)
+
+async def profile_handlers(handler, event, data):
+    if not profiler.active:
+        return await handler(event, data)
+    return await profiler.run(data["handler"].callback.__name__, handler, event, data, update=True)
+
+profiler = Profiler(PROFILE_SAMPLE_RATE)
+session.middleware(ApiTimer())
+dp.message.middleware(profile_handlers)
+dp.callback_query.middleware(profile_handlers)
 
 # ==================== ВСПОМОГАТЕЛЬНЫЕ ФУНКЦИИ ====================
-def is_admin(username):
-    return username == ADMIN_USERNAME if username else False
+def start_background(coro):
+    """Задача, которая переживёт текущий апдейт: без его current_calls и log_context,
+    чтобы её вызовы Bot API и записи логов не приписывались этому апдейту. Остаётся только бот"""
+    context = contextvars.Context()
+    context.run(current_tenant.set, current_tenant.get())
+    return asyncio.create_task(coro, context=context)
+
+def is_admin(user):
+    """Владелец бота (ADMIN_ID): каналы, статистика, очистка, /profile, /repair"""
+    return moderators.is_admin(user)
+
+def is_moderator(user):
+    """Модератор или админ: только очередь, одобрение и отклонение"""
+    return moderators.is_moderator(user)
 
 def is_txt_file(file_name):
     return file_name and file_name.lower().endswith('.txt')
@@ -169,9 +1188,83 @@ def check_limit(post_type, current_count):
     limit = LIMITS.get(post_type, 4)
     return current_count < limit
 
+# ==================== ПРОВЕРКА .TXT ====================
+# Управляющие символы, которых не бывает в текстовом файле (кроме \t, \n, \r)
+BINARY_CHARS = re.compile(r"[\x00-\x08\x0b\x0c\x0e-\x1f\x7f]")
+
+class TxtInvalid(Exception):
+    pass
+
+class TxtValidator:
+    """Файловый объект для bot.download: проверяет .txt по кускам, ничего не храня.
+    Исключение из write() прерывает скачивание."""
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.has_text = False
+        self.decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    
+    def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise TxtInvalid(f"❌ Файл слишком большой (максимум {self.max_bytes // 1024} КБ)")
+        self.check(chunk)
+        return len(chunk)
+    
+    def check(self, chunk, final=False):
+        try:
+            text = self.decoder.decode(chunk, final=final)
+        except UnicodeDecodeError:
+            raise TxtInvalid("❌ Файл должен быть в кодировке UTF-8")
+        if BINARY_CHARS.search(text):
+            raise TxtInvalid("❌ Файл содержит двоичные данные, нужен обычный текст")
+        if not self.has_text and text.strip():
+            self.has_text = True
+    
+    def flush(self):
+        pass
+    
+    def finish(self):
+        self.check(b"", final=True)
+        if not self.has_text:
+            raise TxtInvalid("❌ Файл пустой")
+
+# Вердикты по file_unique_id: None - файл в порядке, иначе текст ошибки
+txt_verdicts = OrderedDict()
+txt_downloads = asyncio.Semaphore(TXT_DOWNLOAD_CONCURRENCY)
+
+async def validate_txt_document(document):
+    """Возвращает текст ошибки или None, если файл подходит"""
+    if not is_txt_file(document.file_name):
+        return "❌ Файл должен быть в формате .txt"
+    if document.file_size and document.file_size > TXT_MAX_BYTES:
+        return f"❌ Файл слишком большой (максимум {TXT_MAX_BYTES // 1024} КБ)"
+    
+    key = document.file_unique_id
+    if key in txt_verdicts:
+        txt_verdicts.move_to_end(key)
+        return txt_verdicts[key]
+    
+    validator = TxtValidator(TXT_MAX_BYTES)
+    try:
+        async with txt_downloads:
+            await bot.download(document, destination=validator, seek=False)
+        validator.finish()
+        verdict = None
+    except TxtInvalid as e:
+        verdict = str(e)
+    except Exception as e:
+        logger.warning("Не удалось скачать файл: %s", e, extra={"category": "txt"})
+        return "❌ Не удалось проверить файл, отправь его ещё раз"
+    
+    txt_verdicts[key] = verdict
+    if len(txt_verdicts) > TXT_CACHE_SIZE:
+        txt_verdicts.popitem(last=False)
+    return verdict
+
 # Временные данные
-temp_data = {}
-temp_channel_add = {}
+temp_data = TenantLocal("temp_data")
+temp_channel_add = TenantLocal("temp_channel_add")
 
 # ==================== КЛАВИАТУРЫ ====================
 def get_start_keyboard(is_admin_user):
@@ -191,6 +1284,14 @@ def get_start_keyboard(is_admin_user):
     builder.adjust(1)
     return builder.as_markup()
 
+def get_panel_keyboard(user):
+    """Админу - всё меню, модератору - только очередь"""
+    if is_admin(user):
+        return get_start_keyboard(True)
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📋 Очередь", callback_data="admin_queue")
+    return builder.as_markup()
+
 def get_cancel_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text="❌ Отмена", callback_data="cancel_post")
@@ -238,6 +1339,35 @@ def get_moderation_keyboard(post_id):
     builder.adjust(2, 1)
     return builder.as_markup()
 
+def get_digest_keyboard():
+    builder = InlineKeyboardBuilder()
+    builder.button(text="📋 Открыть очередь", callback_data="queue_page_0")
+    return builder.as_markup()
+
+def get_review_keyboard(post_id):
+    builder = InlineKeyboardBuilder()
+    builder.button(text="🔍 Открыть пост", callback_data=f"review_{post_id}")
+    return builder.as_markup()
+
+def get_queue_keyboard(posts, page, pages):
+    builder = InlineKeyboardBuilder()
+    now = clock.now()
+    for p in posts:
+        emoji = TYPE_EMOJI.get(p['content']['type'], '📌')
+        claim = moderators.active_claim(p, now)
+        lock = f" 🔒 {moderators.name(claim['moderator'])}" if claim else ""
+        builder.button(text=f"{emoji} #{p['id']} @{p['username']}{lock}", callback_data=f"review_{p['id']}")
+    nav = 0
+    if page > 0:
+        builder.button(text="◀️", callback_data=f"queue_page_{page - 1}")
+        nav += 1
+    if page < pages - 1:
+        builder.button(text="▶️", callback_data=f"queue_page_{page + 1}")
+        nav += 1
+    builder.button(text="🔙 В админ-меню", callback_data="back_to_admin")
+    builder.adjust(*([1] * len(posts) + ([nav] if nav else []) + [1]))
+    return builder.as_markup()
+
 def get_time_keyboard(post_id):
     builder = InlineKeyboardBuilder()
     builder.button(text="⏱️ 10 секунд", callback_data=f"time_10sec_{post_id}")
@@ -247,6 +1377,14 @@ def get_time_keyboard(post_id):
     builder.adjust(1)
     return builder.as_markup()
 
+def get_repair_keyboard(posts):
+    builder = InlineKeyboardBuilder()
+    for p in posts[:10]:
+        builder.button(text=f"🔧 Допубликовать #{p['id']}", callback_data=f"repair_{p['id']}")
+    builder.button(text="🔙 В админ-меню", callback_data="back_to_admin")
+    builder.adjust(1)
+    return builder.as_markup()
+
 def get_clean_keyboard():
     builder = InlineKeyboardBuilder()
     builder.button(text="🧹 Удалить опубликованные", callback_data="clean_published")
@@ -256,11 +1394,251 @@ def get_clean_keyboard():
     builder.adjust(1)
     return builder.as_markup()
 
+# ==================== НАВИГАЦИЯ ====================
+async def show_screen(message, text, reply_markup=None):
+    """Показывает экран меню в сообщении бота: правит его на месте и ничего не шлёт,
+    если текст и кнопки не изменились. Новое сообщение отправляется, только когда
+    править нельзя (медиа, удалённое или слишком старое сообщение)."""
+    if message.text is not None:
+        if message.text == text and message.reply_markup == reply_markup:
+            return message
+        try:
+            result = await message.edit_text(text, reply_markup=reply_markup)
+            return result if isinstance(result, types.Message) else message
+        except TelegramBadRequest as e:
+            if "message is not modified" in str(e):
+                return message
+    return await message.answer(text, reply_markup=reply_markup)
+
+# ==================== МОДЕРАТОРЫ ====================
+class Moderators:
+    """Ростер модераторов, раздача новых постов и аренда поста на время проверки.
+    Захват - проверка и запись без await между ними, поэтому в одном event loop
+    два модератора не могут взять один и тот же пост.
+    Админ (ADMIN_ID) тоже может модерировать, даже если его нет в ростере."""
+    def __init__(self, roster, mode, lease, admin_id):
+        self.roster = roster
+        self.mode = mode
+        self.lease = timedelta(seconds=lease)
+        self.admin_id = admin_id
+        self.turn = 0
+    
+    def is_admin(self, user):
+        return bool(user) and user.id == self.admin_id
+    
+    def is_moderator(self, user):
+        if not user:
+            return False
+        return user.id == self.admin_id or any(user.id == m["id"] for m in self.roster)
+    
+    def default_id(self):
+        return self.roster[0]["id"]
+    
+    def name(self, moderator_id):
+        for m in self.roster:
+            if m.get("id") == moderator_id:
+                return f"@{m['username']}" if m.get("username") else str(moderator_id)
+        return str(moderator_id)
+    
+    def active_claim(self, post, now):
+        claim = post.get("claim")
+        if claim and datetime.fromisoformat(claim["expires"]) > now:
+            return claim
+        return None
+    
+    def load(self, moderator_id, now):
+        return sum(1 for p in db.posts if p["status"] == "pending"
+                   and (self.active_claim(p, now) or {}).get("moderator") == moderator_id)
+    
+    def has_other(self, moderator_id):
+        return any(m["id"] != moderator_id for m in self.roster)
+    
+    def pick(self, now, exclude=None):
+        candidates = [m["id"] for m in self.roster if m["id"] != exclude] or [m["id"] for m in self.roster]
+        if self.mode == "least_load":
+            return min(candidates, key=lambda moderator_id: self.load(moderator_id, now))
+        self.turn += 1
+        return candidates[(self.turn - 1) % len(candidates)]
+    
+    def assign(self, post, exclude=None):
+        """Выдаёт пост модератору с арендой. Возвращает id модератора"""
+        now = clock.now()
+        moderator_id = self.pick(now, exclude)
+        post["claim"] = {
+            "moderator": moderator_id,
+            "assigned_at": now.isoformat(),
+            "expires": (now + self.lease).isoformat()
+        }
+        db.save()
+        return moderator_id
+    
+    def claim(self, post, moderator_id):
+        """Берёт или продлевает аренду. False - пост уже обработан или его держит другой модератор"""
+        if not post or post["status"] != "pending":
+            return False
+        now = clock.now()
+        claim = self.active_claim(post, now)
+        if claim and claim["moderator"] != moderator_id:
+            return False
+        if not claim:
+            post["claim"] = {"moderator": moderator_id, "assigned_at": now.isoformat()}
+        post["claim"]["expires"] = (now + self.lease).isoformat()
+        db.save()
+        return True
+    
+    def release(self, post, moderator_id):
+        """Снимает аренду после решения и учитывает время реакции модератора"""
+        claim = post.pop("claim", None) or {}
+        started = datetime.fromisoformat(claim.get("assigned_at", post["created_at"]))
+        latency = (clock.now() - started).total_seconds()
+        stats = db.moderator_stats.setdefault(str(moderator_id), {"decisions": 0, "total": 0.0, "max": 0.0})
+        stats["decisions"] += 1
+        stats["total"] += latency
+        stats["max"] = max(stats["max"], latency)
+        db.save()
+    
+    def expired(self, now):
+        return [p for p in db.posts if p["status"] == "pending" and p.get("claim") and not self.active_claim(p, now)]
+
+moderators = TenantLocal("moderators")
+
+async def requeue_expired(now):
+    """Посты, которые модератор не успел проверить за время аренды, уходят следующему.
+    Если передать некому, аренда просто снимается: пост остаётся в общей очереди"""
+    for post in moderators.expired(now):
+        previous = post["claim"]["moderator"]
+        if not moderators.has_other(previous):
+            post.pop("claim")
+            db.save()
+            continue
+        moderators.assign(post, exclude=previous)
+        logger.info("Пост передан другому модератору", extra={"category": "moderation", "post_id": post["id"]})
+        try:
+            await notifier.post_reassigned(post, previous)
+        except Exception as e:
+            logger.error("Ошибка передачи поста: %s", e, extra={"category": "moderation", "post_id": post["id"]})
+
+# ==================== УВЕДОМЛЕНИЯ АДМИНУ ====================
+async def send_post_preview(chat_id, post, note=""):
+    """Медиа и файлы поста плюс сообщение с кнопками модерации"""
+    content = post['content']
+    post_id = post['id']
+    type_name = TYPE_NAMES.get(content['type'], '📌 Пост')
+    channel = next((ch for ch in db.channels if ch['id'] == post.get('channel')), None)
+    channel_text = f" для {channel.get('title', channel['id'])}" if channel else ""
+    
+    for photo_id in content.get('photos', []):
+        await bot.send_photo(chat_id, photo_id, caption=f"{type_name} #{post_id} от @{post['username']}{channel_text}")
+    
+    for video_id in content.get('videos', []):
+        await bot.send_video(chat_id, video_id, caption=f"{type_name} #{post_id} от @{post['username']}{channel_text}")
+    
+    if content['type'] == 'livery':
+        if content['files'].get('body'):
+            await bot.send_document(chat_id, content['files']['body']['file_id'], caption=f"📁 КУЗОВ для поста #{post_id}")
+        if content['files'].get('glass'):
+            await bot.send_document(chat_id, content['files']['glass']['file_id'], caption=f"📁 СТЕКЛО для поста #{post_id}")
+    elif content['type'] == 'sticker' and content['files'].get('sticker'):
+        await bot.send_document(chat_id, content['files']['sticker']['file_id'], caption=f"🏷️ Наклейка для поста #{post_id}")
+    
+    await bot.send_message(chat_id, f"🔍 {type_name} #{post_id}{channel_text}:{note}", reply_markup=get_moderation_keyboard(post_id))
+
+class AdminNotifier:
+    """Уведомления модераторам о новых постах и публикациях: сразу или сводкой (NOTIFY_MODE=digest)"""
+    def __init__(self, mode, window, max_items):
+        self.mode = mode
+        self.window = window
+        self.max_items = max_items
+        self.buffers = {}
+    
+    async def post_submitted(self, post, note=""):
+        chat_id = post.get('claim', {}).get('moderator') or moderators.default_id()
+        if self.mode != "digest":
+            await send_post_preview(chat_id, post, note)
+            return
+        emoji = TYPE_EMOJI.get(post['content']['type'], '📌')
+        self.buffer(chat_id)["submitted"].append(f"{emoji} #{post['id']} @{post['username']}{' ⚠️' if note else ''}")
+        await self.added(chat_id)
+    
+    async def post_reassigned(self, post, previous):
+        """Пост перешёл к другому модератору: одна строка со ссылкой на пост, без повторной отправки медиа"""
+        chat_id = post['claim']['moderator']
+        note = f"⏰ Передан от {moderators.name(previous)}: аренда истекла"
+        if self.mode != "digest":
+            await bot.send_message(chat_id, f"{note}\n🔍 Пост #{post['id']} от @{post['username']}", reply_markup=get_review_keyboard(post['id']))
+            return
+        emoji = TYPE_EMOJI.get(post['content']['type'], '📌')
+        self.buffer(chat_id)["submitted"].append(f"{emoji} #{post['id']} @{post['username']} ⏰")
+        await self.added(chat_id)
+    
+    async def post_published(self, post, channel_name):
+        chat_id = post.get('moderator') or moderators.default_id()
+        if self.mode != "digest":
+            await bot.send_message(chat_id, f"✅ Пост #{post['id']} опубликован в {channel_name}")
+            return
+        self.buffer(chat_id)["published"].append(f"#{post['id']} → {channel_name}")
+        await self.added(chat_id)
+    
+    def buffer(self, chat_id):
+        return self.buffers.setdefault(chat_id, {"submitted": [], "published": [], "timer": None})
+    
+    async def added(self, chat_id):
+        buffer = self.buffer(chat_id)
+        if len(buffer["submitted"]) + len(buffer["published"]) >= self.max_items:
+            await self.flush(chat_id)
+        elif buffer["timer"] is None:
+            buffer["timer"] = start_background(self.flush_later(chat_id))
+    
+    async def flush_later(self, chat_id):
+        await clock.sleep(self.window)
+        self.buffer(chat_id)["timer"] = None
+        await self.flush(chat_id)
+    
+    async def flush(self, chat_id=None):
+        if chat_id is None:
+            for chat_id in list(self.buffers):
+                await self.flush(chat_id)
+            return
+        
+        buffer = self.buffers.pop(chat_id, None)
+        if not buffer:
+            return
+        if buffer["timer"] and buffer["timer"] is not asyncio.current_task():
+            buffer["timer"].cancel()
+        submitted, published = buffer["submitted"], buffer["published"]
+        if not submitted and not published:
+            return
+        
+        text = "📬 Сводка"
+        if submitted:
+            text += f"\n\n🆕 Новых на модерации: {len(submitted)}\n" + "\n".join(submitted[:15])
+            if len(submitted) > 15:
+                text += f"\n... и ещё {len(submitted) - 15}"
+        if published:
+            text += f"\n\n✅ Опубликовано: {len(published)}\n" + "\n".join(published[:15])
+            if len(published) > 15:
+                text += f"\n... и ещё {len(published) - 15}"
+        try:
+            await bot.send_message(chat_id, text, reply_markup=get_digest_keyboard() if submitted else None)
+        except Exception as e:
+            logger.error("Ошибка отправки сводки: %s", e, extra={"category": "notify"})
+
+notifier = TenantLocal("notifier")
+
+for settings in TENANTS:
+    tenant = Tenant(settings, session)
+    if tenant.bot.id in tenants_by_bot:
+        sys.exit(f"Один и тот же BOT_TOKEN указан у нескольких тенантов ({tenant.name})")
+    tenants.append(tenant)
+    tenants_by_bot[tenant.bot.id] = tenant
+# Вне апдейтов (импорт, replay.py, simulate.py) - первый бот
+current_tenant.set(tenants[0])
+
 # ==================== КОМАНДЫ ====================
 @dp.message(Command("start"))
 async def cmd_start(message: types.Message, state: FSMContext):
     user = message.from_user
-    admin_user = is_admin(user.username)
+    moderator_user = is_moderator(user)
     
     await state.clear()
     if user.id in temp_data:
@@ -271,13 +1649,14 @@ async def cmd_start(message: types.Message, state: FSMContext):
     except:
         pass
     
-    if admin_user:
+    if moderator_user:
+        title = "🔑 Панель администратора" if is_admin(user) else "🔑 Панель модератора"
         current = db.get_current_channel()
         if current:
-            text = f"🔑 Панель администратора\n📢 Текущий канал: {current.get('title', current['id'])}"
+            text = f"{title}\n📢 Текущий канал: {current.get('title', current['id'])}"
         else:
-            text = "🔑 Панель администратора\n⚠️ Канал не выбран! Добавьте канал в управлении."
-        await message.answer(text, reply_markup=get_start_keyboard(True))
+            text = f"{title}\n⚠️ Канал не выбран! Добавьте канал в управлении."
+        await message.answer(text, reply_markup=get_panel_keyboard(user))
     else:
         text = (
             "👋 Привет! Что хочешь отправить?\n\n"
@@ -288,6 +1667,82 @@ async def cmd_start(message: types.Message, state: FSMContext):
         )
         await message.answer(text, reply_markup=get_start_keyboard(False))
 
+@dp.message(Command("profile"))
+async def cmd_profile(message: types.Message):
+    if not is_admin(message.from_user):
+        return
+    
+    # /profile 60 - на 60 секунд, /profile 100u - на 100 апдейтов, /profile stop
+    arg = (message.text.split(maxsplit=1)[1:] or ["60"])[0].strip().lower()
+    if arg == "stop":
+        if profiler.active:
+            await profiler.finish()
+        else:
+            await message.answer("ℹ️ Профилирование не запущено")
+        return
+    if profiler.active:
+        await message.answer("ℹ️ Профилирование уже идёт. /profile stop - остановить")
+        return
+    
+    try:
+        count = int(arg[:-1] if arg.endswith("u") else arg)
+    except ValueError:
+        count = 0
+    # Без срока и лимита профилировщик остался бы включён навсегда
+    if count <= 0:
+        await message.answer("❌ Формат: /profile 60, /profile 100u или /profile stop (число больше нуля)")
+        return
+    
+    if arg.endswith("u"):
+        profiler.start(message.chat.id, updates=count)
+        await message.answer(f"📈 Профилирую следующие {count} апдейтов")
+    else:
+        profiler.start(message.chat.id, seconds=count)
+        await message.answer(f"📈 Профилирую {count} с")
+
+@dp.message(Command("repair"))
+async def cmd_repair(message: types.Message):
+    if not is_admin(message.from_user):
+        return
+    
+    posts = db.get_unfinished_posts()
+    if not posts:
+        await message.answer("✅ Недопубликованных постов нет")
+        return
+    
+    text = "🔧 Недопубликованные посты:\n"
+    for p in posts[:10]:
+        done = len(p.get('publish_progress', []))
+        text += f"\n#{p['id']}: шагов {done}/{len(publish_steps(p))}, попыток {p.get('publish_attempts', 0)}"
+        if p.get('publish_error'):
+            text += f"\n   ⚠️ {p['publish_error'][:100]}"
+    await message.answer(text, reply_markup=get_repair_keyboard(posts))
+
+@dp.callback_query(F.data.startswith("repair_"))
+async def repair_post(callback: CallbackQuery):
+    if not is_admin(callback.from_user):
+        await callback.answer("⛔ Доступ запрещён", show_alert=True)
+        return
+    
+    post = db.get_post(int(callback.data.replace("repair_", "")))
+    if not post or post['status'] != 'approved':
+        await callback.answer("✅ Пост уже опубликован", show_alert=True)
+        return
+    
+    try:
+        if not await publish_post(post):
+            await callback.answer("⏳ Пост сейчас публикуется", show_alert=True)
+            return
+    except Exception as e:
+        record_publish_error(post, e)
+        await callback.answer(f"❌ Не получилось: {str(e)[:150]}", show_alert=True)
+        return
+    
+    db.archive_post(post)
+    await notify_published(post)
+    await show_screen(callback.message, f"✅ Пост #{post['id']} допубликован", reply_markup=get_repair_keyboard(db.get_unfinished_posts()))
+    await callback.answer()
+
 # ==================== ОТМЕНА ====================
 @dp.callback_query(F.data == "cancel_post")
 async def cancel_post(callback: CallbackQuery, state: FSMContext):
@@ -298,11 +1753,6 @@ async def cancel_post(callback: CallbackQuery, state: FSMContext):
     
     await state.clear()
     
-    try:
-        await callback.message.delete()
-    except:
-        pass
-    
     text = (
         "👋 Привет! Что хочешь отправить?\n\n"
         "📤 Обычный пост - фото/видео (максимум 4 файла)\n"
@@ -311,9 +1761,10 @@ async def cancel_post(callback: CallbackQuery, state: FSMContext):
         "⚠️ Файлы .txt должны быть в формате .txt"
     )
     
-    await callback.message.answer(
+    await show_screen(
+        callback.message,
         text,
-        reply_markup=get_start_keyboard(is_admin(callback.from_user.username))
+        reply_markup=get_start_keyboard(is_admin(callback.from_user))
     )
     await callback.answer("❌ Отменено")
 
@@ -326,15 +1777,12 @@ async def new_regular(callback: CallbackQuery, state: FSMContext):
     temp_data[user_id] = {
         'photos': [],
         'videos': [],
+        'unique_ids': [],
         'type': 'regular'
     }
     
-    try:
-        await callback.message.delete()
-    except:
-        pass
-    
-    await callback.message.answer(
+    await show_screen(
+        callback.message,
         "📤 Отправляй фото или видео (максимум 4 файла)\nКогда закончишь - нажми Готово",
         reply_markup=get_content_keyboard()
     )
@@ -349,15 +1797,12 @@ async def new_livery(callback: CallbackQuery, state: FSMContext):
         'photos': [],
         'body_file': None,
         'glass_file': None,
+        'unique_ids': [],
         'type': 'livery'
     }
     
-    try:
-        await callback.message.delete()
-    except:
-        pass
-    
-    await callback.message.answer(
+    await show_screen(
+        callback.message,
         "👕 Создание ливреи\n\nОтправь фото ливреи (максимум 4 фото)\nКогда закончишь - нажми Готово",
         reply_markup=get_content_keyboard()
     )
@@ -371,15 +1816,12 @@ async def new_sticker(callback: CallbackQuery, state: FSMContext):
     temp_data[user_id] = {
         'photos': [],
         'sticker_file': None,
+        'unique_ids': [],
         'type': 'sticker'
     }
     
-    try:
-        await callback.message.delete()
-    except:
-        pass
-    
-    await callback.message.answer(
+    await show_screen(
+        callback.message,
         "🏷️ Создание наклейки\n\nОтправь фото наклейки (только 1 фото)\nКогда отправишь - нажми Готово",
         reply_markup=get_content_keyboard()
     )
@@ -399,9 +1841,11 @@ async def collect_regular_media(message: types.Message, state: FSMContext):
     
     if message.photo and check_limit('regular', current_count):
         data['photos'].append(message.photo[-1].file_id)
+        data['unique_ids'].append(message.photo[-1].file_unique_id)
         await message.reply(f"✅ Фото добавлено ({current_count + 1}/{LIMITS['regular']})")
     elif message.video and check_limit('regular', current_count):
         data['videos'].append(message.video.file_id)
+        data['unique_ids'].append(message.video.file_unique_id)
         await message.reply(f"✅ Видео добавлено ({current_count + 1}/{LIMITS['regular']})")
     else:
         await message.reply(get_limit_text('regular'))
@@ -423,6 +1867,7 @@ async def collect_livery_photo(message: types.Message, state: FSMContext):
     
     if check_limit('livery', current_count):
         data['photos'].append(message.photo[-1].file_id)
+        data['unique_ids'].append(message.photo[-1].file_unique_id)
         await message.reply(f"✅ Фото добавлено ({current_count + 1}/{LIMITS['livery']})")
     else:
         await message.reply(get_limit_text('livery'))
@@ -444,6 +1889,7 @@ async def collect_sticker_photo(message: types.Message, state: FSMContext):
     
     if check_limit('sticker', current_count):
         data['photos'].append(message.photo[-1].file_id)
+        data['unique_ids'].append(message.photo[-1].file_unique_id)
         await message.reply(f"✅ Фото добавлено ({current_count + 1}/{LIMITS['sticker']})")
     else:
         await message.reply(get_limit_text('sticker'))
@@ -468,21 +1914,21 @@ async def content_done(callback: CallbackQuery, state: FSMContext):
         total = len(data.get('photos', [])) + len(data.get('videos', []))
         text = f"📋 Проверь содержимое:\n📸 Фото: {len(data.get('photos', []))}\n🎥 Видео: {len(data.get('videos', []))}\n📊 Всего: {total}/{LIMITS['regular']}\n\nВсё верно?"
         await state.set_state(PostStates.confirm_post)
-        await callback.message.edit_text(text, reply_markup=get_confirm_keyboard())
+        await show_screen(callback.message, text, reply_markup=get_confirm_keyboard())
     
     elif current_state == PostStates.collecting_livery_photo.state:
         if not data.get('photos'):
             await callback.answer("❌ Сначала отправь фото", show_alert=True)
             return
         await state.set_state(PostStates.waiting_livery_body_file)
-        await callback.message.edit_text("📁 Отправь файл на КУЗОВ (только .txt)", reply_markup=get_cancel_keyboard())
+        await show_screen(callback.message, "📁 Отправь файл на КУЗОВ (только .txt)", reply_markup=get_cancel_keyboard())
     
     elif current_state == PostStates.collecting_sticker_photo.state:
         if not data.get('photos'):
             await callback.answer("❌ Сначала отправь фото", show_alert=True)
             return
         await state.set_state(PostStates.waiting_sticker_file)
-        await callback.message.edit_text("📁 Отправь файл с наклейкой (только .txt)", reply_markup=get_cancel_keyboard())
+        await show_screen(callback.message, "📁 Отправь файл с наклейкой (только .txt)", reply_markup=get_cancel_keyboard())
     
     await callback.answer()
 
@@ -495,12 +1941,16 @@ async def get_livery_body_file(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    if not is_txt_file(message.document.file_name):
-        await message.reply("❌ Файл должен быть в формате .txt")
+    error = await validate_txt_document(message.document)
+    if error:
+        await message.reply(error)
+        return
+    if user_id not in temp_data:  # пост отменили, пока файл проверялся
         return
     
     temp_data[user_id]['body_file'] = {
         'file_id': message.document.file_id,
+        'file_unique_id': message.document.file_unique_id,
         'file_name': message.document.file_name
     }
     
@@ -515,12 +1965,16 @@ async def get_livery_glass_file(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    if not is_txt_file(message.document.file_name):
-        await message.reply("❌ Файл должен быть в формате .txt")
+    error = await validate_txt_document(message.document)
+    if error:
+        await message.reply(error)
+        return
+    if user_id not in temp_data:  # пост отменили, пока файл проверялся
         return
     
     temp_data[user_id]['glass_file'] = {
         'file_id': message.document.file_id,
+        'file_unique_id': message.document.file_unique_id,
         'file_name': message.document.file_name
     }
     
@@ -538,12 +1992,16 @@ async def get_sticker_file(message: types.Message, state: FSMContext):
         await state.clear()
         return
     
-    if not is_txt_file(message.document.file_name):
-        await message.reply("❌ Файл должен быть в формате .txt")
+    error = await validate_txt_document(message.document)
+    if error:
+        await message.reply(error)
+        return
+    if user_id not in temp_data:  # пост отменили, пока файл проверялся
         return
     
     temp_data[user_id]['sticker_file'] = {
         'file_id': message.document.file_id,
+        'file_unique_id': message.document.file_unique_id,
         'file_name': message.document.file_name
     }
     
@@ -590,34 +2048,38 @@ async def confirm_send(callback: CallbackQuery, state: FSMContext):
             }
         }
     
+    file_ids = [f['file_unique_id'] for f in content.get('files', {}).values() if f and f.get('file_unique_id')]
+    content['unique_ids'] = data.get('unique_ids', []) + file_ids
+    # Повторы ищутся до отправки чего-либо админу
+    duplicates = db.find_duplicates(content['unique_ids']) if DUPLICATE_MODE != "off" else {}
+    exact = db.exact_duplicates(content['unique_ids'], duplicates)
+    if exact and DUPLICATE_MODE == "reject":
+        del temp_data[user_id]
+        await state.clear()
+        await show_screen(callback.message,
+            f"♻️ Такой пост уже присылали (#{exact[0]}), повторно отправлять не нужно",
+            reply_markup=get_start_keyboard(False)
+        )
+        await callback.answer()
+        return
+    
     post_id = db.add_post(user_id, username, content)
     
     # Отправка админу
-    current_channel = db.get_current_channel()
-    channel_text = f" для {current_channel.get('title', db.current_channel)}" if current_channel else ""
-    
-    type_names = {'regular': '📤 Обычный пост', 'livery': '👕 Ливрея', 'sticker': '🏷️ Наклейка'}
-    
-    for photo_id in content.get('photos', []):
-        await bot.send_photo(ADMIN_ID, photo_id, caption=f"{type_names[data['type']]} #{post_id} от @{username}{channel_text}")
-    
-    for video_id in content.get('videos', []):
-        await bot.send_video(ADMIN_ID, video_id, caption=f"{type_names[data['type']]} #{post_id} от @{username}{channel_text}")
-    
-    if data['type'] == 'livery':
-        if content['files'].get('body'):
-            await bot.send_document(ADMIN_ID, content['files']['body']['file_id'], caption=f"📁 КУЗОВ для поста #{post_id}")
-        if content['files'].get('glass'):
-            await bot.send_document(ADMIN_ID, content['files']['glass']['file_id'], caption=f"📁 СТЕКЛО для поста #{post_id}")
-    elif data['type'] == 'sticker' and content['files'].get('sticker'):
-        await bot.send_document(ADMIN_ID, content['files']['sticker']['file_id'], caption=f"🏷️ Наклейка для поста #{post_id}")
+    duplicate_text = ""
+    if duplicates:
+        duplicate_text = "\n⚠️ Повтор: " + ", ".join(
+            f"#{dup_id} ({count} из {len(set(content['unique_ids']))} файлов)" for dup_id, count in sorted(duplicates.items())[:5]
+        )
     
-    await bot.send_message(ADMIN_ID, f"🔍 {type_names[data['type']]} #{post_id}{channel_text}:", reply_markup=get_moderation_keyboard(post_id))
+    post = db.get_post(post_id)
+    moderators.assign(post)
+    await notifier.post_submitted(post, duplicate_text)
     
     del temp_data[user_id]
     await state.clear()
     
-    await callback.message.edit_text(f"✅ {type_names[data['type']]} отправлен на проверку!")
+    await show_screen(callback.message, f"✅ {TYPE_NAMES[data['type']]} отправлен на проверку!")
     await callback.answer()
 
 @dp.callback_query(F.data == "confirm_redo")
@@ -631,44 +2093,48 @@ async def confirm_redo(callback: CallbackQuery, state: FSMContext):
     
     data = temp_data[user_id]
     
+    data['unique_ids'] = []
     if data['type'] == 'regular':
         data['photos'] = []
         data['videos'] = []
         await state.set_state(PostStates.collecting_media)
-        await callback.message.edit_text("📤 Отправляй фото или видео заново:", reply_markup=get_content_keyboard())
+        await show_screen(callback.message, "📤 Отправляй фото или видео заново:", reply_markup=get_content_keyboard())
     elif data['type'] == 'livery':
         data['photos'] = []
         data['body_file'] = None
         data['glass_file'] = None
         await state.set_state(PostStates.collecting_livery_photo)
-        await callback.message.edit_text("👕 Отправь фото ливреи заново:", reply_markup=get_content_keyboard())
+        await show_screen(callback.message, "👕 Отправь фото ливреи заново:", reply_markup=get_content_keyboard())
     else:
         data['photos'] = []
         data['sticker_file'] = None
         await state.set_state(PostStates.collecting_sticker_photo)
-        await callback.message.edit_text("🏷️ Отправь фото наклейки заново:", reply_markup=get_content_keyboard())
+        await show_screen(callback.message, "🏷️ Отправь фото наклейки заново:", reply_markup=get_content_keyboard())
     
     await callback.answer()
 
 # ==================== УПРАВЛЕНИЕ КАНАЛАМИ ====================
 @dp.callback_query(F.data == "manage_channels")
 async def manage_channels(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
-    text = "📢 Список каналов:\n✅ - текущий канал" if db.channels else "📢 У вас нет добавленных каналов."
-    await callback.message.edit_text(text, reply_markup=get_channels_keyboard())
+    await render_channels(callback.message)
     await callback.answer()
 
+async def render_channels(message):
+    text = "📢 Список каналов:\n✅ - текущий канал" if db.channels else "📢 У вас нет добавленных каналов."
+    await show_screen(message, text, reply_markup=get_channels_keyboard())
+
 @dp.callback_query(F.data == "add_channel")
 async def add_channel_start(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
     temp_channel_add[callback.from_user.id] = True
-    await callback.message.edit_text(
+    await show_screen(callback.message,
         "📝 Отправьте ссылку на канал или его ID\nПримеры: @channel, -1001234567890\n❗️ Бот должен быть администратором!",
         reply_markup=InlineKeyboardBuilder().button(text="◀️ Отмена", callback_data="manage_channels").as_markup()
     )
@@ -678,7 +2144,7 @@ async def add_channel_start(callback: CallbackQuery):
 async def handle_channel_input(message: types.Message):
     user_id = message.from_user.id
     
-    if user_id in temp_channel_add and is_admin(message.from_user.username):
+    if user_id in temp_channel_add and is_admin(message.from_user):
         channel_input = message.text.strip()
         
         if 't.me/' in channel_input:
@@ -697,7 +2163,7 @@ async def handle_channel_input(message: types.Message):
 
 @dp.callback_query(F.data.startswith("select_channel_"))
 async def select_channel(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
@@ -708,95 +2174,131 @@ async def select_channel(callback: CallbackQuery):
         text = f"📢 Канал: {channel.get('title', channel['id'])}\nID: {channel['id']}"
         if channel_id == db.current_channel:
             text += "\n\n✅ Это текущий канал"
-        await callback.message.edit_text(text, reply_markup=get_channel_actions_keyboard(channel_id))
+        await show_screen(callback.message, text, reply_markup=get_channel_actions_keyboard(channel_id))
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("set_current_"))
 async def set_current_channel(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
     channel_id = callback.data.replace("set_current_", "")
     if db.set_current_channel(channel_id):
         await callback.answer("✅ Текущий канал изменён")
-        await manage_channels(callback)
+        await render_channels(callback.message)
     else:
         await callback.answer("❌ Ошибка", show_alert=True)
 
 @dp.callback_query(F.data.startswith("delete_channel_"))
 async def delete_channel(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
     channel_id = callback.data.replace("delete_channel_", "")
     db.remove_channel(channel_id)
     await callback.answer("✅ Канал удалён")
-    await manage_channels(callback)
+    await render_channels(callback.message)
 
 @dp.callback_query(F.data == "back_to_admin")
 async def back_to_admin(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_moderator(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
+    title = "🔑 Панель администратора" if is_admin(callback.from_user) else "🔑 Панель модератора"
     current = db.get_current_channel()
-    text = f"🔑 Панель администратора\n📢 Текущий канал: {current.get('title', current['id'])}" if current else "🔑 Панель администратора\n⚠️ Канал не выбран!"
+    text = f"{title}\n📢 Текущий канал: {current.get('title', current['id'])}" if current else f"{title}\n⚠️ Канал не выбран!"
     
-    try:
-        await callback.message.delete()
-    except:
-        pass
-    
-    await callback.message.answer(text, reply_markup=get_start_keyboard(True))
+    await show_screen(callback.message, text, reply_markup=get_panel_keyboard(callback.from_user))
     await callback.answer()
 
 # ==================== МОДЕРАЦИЯ ====================
 @dp.callback_query(F.data == "admin_queue")
 async def show_queue(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_moderator(callback.from_user):
+        await callback.answer("⛔ Доступ запрещён", show_alert=True)
+        return
+    
+    await show_queue_page(callback, 0)
+
+@dp.callback_query(F.data.startswith("queue_page_"))
+async def queue_page(callback: CallbackQuery):
+    if not is_moderator(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
+    await show_queue_page(callback, int(callback.data.replace("queue_page_", "")))
+
+async def claim_or_explain(callback: CallbackQuery, post):
+    """Берёт пост в работу для нажавшего модератора или объясняет, почему нельзя"""
+    if moderators.claim(post, callback.from_user.id):
+        return True
+    if not post or post['status'] != 'pending':
+        await callback.answer("❌ Пост уже обработан", show_alert=True)
+    else:
+        await callback.answer(f"🔒 Пост проверяет {moderators.name(post['claim']['moderator'])}", show_alert=True)
+    return False
+
+async def show_queue_page(callback: CallbackQuery, page):
     pending = db.get_pending_posts()
     
     if not pending:
-        await callback.message.edit_text("📭 Нет постов на модерации", reply_markup=get_start_keyboard(True))
+        await show_screen(callback.message, "📭 Нет постов на модерации", reply_markup=get_panel_keyboard(callback.from_user))
+        await callback.answer()
         return
     
-    text = "📋 Ожидают проверки:\n\n"
-    for p in pending[:5]:
-        emoji = {'regular': '📤', 'livery': '👕', 'sticker': '🏷️'}.get(p['content']['type'], '📌')
-        text += f"{emoji} #{p['id']} @{p['username']}\n"
+    pages = (len(pending) + QUEUE_PAGE_SIZE - 1) // QUEUE_PAGE_SIZE
+    page = max(0, min(page, pages - 1))
+    posts = pending[page * QUEUE_PAGE_SIZE:(page + 1) * QUEUE_PAGE_SIZE]
+    text = f"📋 Ожидают проверки: {len(pending)}\nСтраница {page + 1}/{pages}, нажми на пост, чтобы открыть"
     
-    await callback.message.edit_text(text, reply_markup=get_start_keyboard(True))
+    await show_screen(callback.message, text, reply_markup=get_queue_keyboard(posts, page, pages))
+    await callback.answer()
+
+@dp.callback_query(F.data.startswith("review_"))
+async def review_post(callback: CallbackQuery):
+    if not is_moderator(callback.from_user):
+        await callback.answer("⛔ Доступ запрещён", show_alert=True)
+        return
+    
+    post = db.get_post(int(callback.data.replace("review_", "")))
+    if not await claim_or_explain(callback, post):
+        return
+    
+    await send_post_preview(callback.message.chat.id, post)
     await callback.answer()
 
 @dp.callback_query(F.data.startswith("approve_"))
 async def approve_post(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_moderator(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
     post_id = int(callback.data.split("_")[1])
+    if not await claim_or_explain(callback, db.get_post(post_id)):
+        return
     
     if not db.get_current_channel():
-        await callback.message.edit_text("⚠️ Сначала добавьте канал!", reply_markup=get_start_keyboard(True))
+        await show_screen(callback.message, "⚠️ Сначала добавьте канал!", reply_markup=get_panel_keyboard(callback.from_user))
         return
     
-    await callback.message.edit_text(f"⏱ Время для поста #{post_id}:", reply_markup=get_time_keyboard(post_id))
+    await show_screen(callback.message, f"⏱ Время для поста #{post_id}:", reply_markup=get_time_keyboard(post_id))
 
 @dp.callback_query(F.data.startswith("reject_"))
 async def reject_post(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_moderator(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
     post_id = int(callback.data.split("_")[1])
     post = db.get_post(post_id)
+    if not await claim_or_explain(callback, post):
+        return
     
     if post:
+        moderators.release(post, callback.from_user.id)
         try:
             await bot.send_message(post['user_id'], "😔 Пост не прошёл модерацию, но мы ценим твою поддержку! 🌟")
             await bot.send_message(post['user_id'], "👋 Что хочешь отправить?", reply_markup=get_start_keyboard(False))
@@ -804,11 +2306,11 @@ async def reject_post(callback: CallbackQuery):
             pass
         db.delete_post(post_id)
     
-    await callback.message.edit_text("❌ Пост отклонён", reply_markup=get_start_keyboard(True))
+    await show_screen(callback.message, "❌ Пост отклонён", reply_markup=get_panel_keyboard(callback.from_user))
 
 @dp.callback_query(F.data.startswith("time_"))
 async def set_time(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_moderator(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
@@ -816,7 +2318,11 @@ async def set_time(callback: CallbackQuery):
     time_type = parts[1]
     post_id = int(parts[2])
     
-    now = datetime.now()
+    post = db.get_post(post_id)
+    if not await claim_or_explain(callback, post):
+        return
+    
+    now = clock.now()
     scheduled = None
     
     if time_type == "10sec":
@@ -826,9 +2332,10 @@ async def set_time(callback: CallbackQuery):
     elif time_type == "schedule":
         scheduled = (now + timedelta(days=1)).replace(hour=6, minute=0).isoformat()
     
+    moderators.release(post, callback.from_user.id)
+    post['moderator'] = callback.from_user.id
     db.approve_post(post_id, scheduled)
     
-    post = db.get_post(post_id)
     if post:
         try:
             await bot.send_message(post['user_id'], "✅ Пост одобрен! Спасибо за помощь! 🙏")
@@ -839,19 +2346,19 @@ async def set_time(callback: CallbackQuery):
     channel = db.get_current_channel()
     channel_name = channel.get('title', db.current_channel) if channel else "канал"
     
-    await callback.message.edit_text(f"✅ Пост #{post_id} добавлен в очередь\n📢 Канал: {channel_name}", reply_markup=get_start_keyboard(True))
+    await show_screen(callback.message, f"✅ Пост #{post_id} добавлен в очередь\n📢 Канал: {channel_name}", reply_markup=get_panel_keyboard(callback.from_user))
 
 # ==================== СТАТИСТИКА И ОЧИСТКА ====================
 @dp.callback_query(F.data == "admin_stats")
 async def show_stats(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
-    total = len(db.posts)
     pending = len([p for p in db.posts if p['status'] == 'pending'])
     approved = len([p for p in db.posts if p['status'] == 'approved'])
-    published = len([p for p in db.posts if p['status'] == 'published'])
+    published = db.archived_count()
+    total = len(db.posts) + published
     
     text = f"📊 Статистика:\n\n📝 Всего: {total}\n⏳ На модерации: {pending}\n✅ Одобрено: {approved}\n📢 Опубликовано: {published}\n\n📢 Каналов: {len(db.channels)}"
     
@@ -859,46 +2366,51 @@ async def show_stats(callback: CallbackQuery):
     current_name = current.get('title', db.current_channel) if current else "не выбран"
     text += f"\n📍 Текущий: {current_name}"
     
-    await callback.message.edit_text(text, reply_markup=get_start_keyboard(True))
+    now = clock.now()
+    text += "\n\n👮 Модераторы:"
+    for m in moderators.roster:
+        stats = db.moderator_stats.get(str(m['id']), {})
+        decisions = stats.get('decisions', 0)
+        average = stats.get('total', 0) / decisions / 60 if decisions else 0
+        text += (f"\n{moderators.name(m['id'])}: решений {decisions}, ср. {average:.1f} мин, "
+                 f"макс {stats.get('max', 0) / 60:.1f} мин, в работе {moderators.load(m['id'], now)}")
+    
+    await show_screen(callback.message, text, reply_markup=get_panel_keyboard(callback.from_user))
 
 @dp.callback_query(F.data == "clean_menu")
 async def clean_menu(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
-    await callback.message.edit_text("🧹 Меню очистки:", reply_markup=get_clean_keyboard())
+    await show_screen(callback.message, "🧹 Меню очистки:", reply_markup=get_clean_keyboard())
 
 @dp.callback_query(F.data == "clean_published")
 async def clean_published(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
-    before = len(db.posts)
-    db.posts = [p for p in db.posts if p['status'] != 'published']
-    db.save()
+    removed = db.clear_archive()
     after = len(db.posts)
     
-    await callback.message.edit_text(f"🧹 Удалено опубликованных: {before - after}\nОсталось: {after}", reply_markup=get_clean_keyboard())
+    await show_screen(callback.message, f"🧹 Удалено опубликованных: {removed}\nОсталось: {after}", reply_markup=get_clean_keyboard())
 
 @dp.callback_query(F.data == "clean_30days")
 async def clean_30days(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
-    now = datetime.now()
-    before = len(db.posts)
-    db.posts = [p for p in db.posts if datetime.fromisoformat(p['created_at']) > now - timedelta(days=30)]
-    db.save()
-    after = len(db.posts)
+    cutoff = clock.now() - timedelta(days=30)
+    removed = db.prune_posts(cutoff) + db.prune_archive(cutoff)
+    after = len(db.posts) + db.archived_count()
     
-    await callback.message.edit_text(f"🧹 Удалено старых: {before - after}\nОсталось: {after}", reply_markup=get_clean_keyboard())
+    await show_screen(callback.message, f"🧹 Удалено старых: {removed}\nОсталось: {after}", reply_markup=get_clean_keyboard())
 
 @dp.callback_query(F.data == "clean_stats")
 async def clean_stats(callback: CallbackQuery):
-    if not is_admin(callback.from_user.username):
+    if not is_admin(callback.from_user):
         await callback.answer("⛔ Доступ запрещён", show_alert=True)
         return
     
@@ -909,48 +2421,133 @@ async def no_action(callback: CallbackQuery):
     await callback.answer()
 
 # ==================== ПУБЛИКАЦИЯ ====================
+# Посты, которые публикуются прямо сейчас (планировщиком или через /repair)
+publishing_now = TenantLocal("publishing_now")
+
+def publish_steps(post):
+    """Шаги публикации по порядку: (вид, file_id или текст, подпись)"""
+    content = post['content']
+    steps = [("photo", photo_id, None) for photo_id in content.get('photos', [])]
+    steps += [("video", video_id, None) for video_id in content.get('videos', [])]
+    steps.append(("message", f"✍️ Автор: @{post['username']}", None))
+    if content['type'] == 'livery':
+        if content['files'].get('body'):
+            steps.append(("document", content['files']['body']['file_id'], "📁 Кузов"))
+        if content['files'].get('glass'):
+            steps.append(("document", content['files']['glass']['file_id'], "📁 Стекло"))
+    elif content['type'] == 'sticker' and content['files'].get('sticker'):
+        steps.append(("document", content['files']['sticker']['file_id'], "🏷️ Наклейка"))
+    return steps
+
+async def publish_post(post):
+    """Публикует пост по шагам. После каждого шага его message_id пишется в журнал
+    (db.record_progress), поэтому повтор после сбоя продолжает с первого незавершённого шага.
+    Опубликованный пост помечается, в архив его переносит вызывающий (db.archive_posts).
+    Возвращает False, если пост уже публикуется в другой задаче."""
+    if post['id'] in publishing_now:
+        return False
+    publishing_now.add(post['id'])
+    try:
+        channel_id = post['channel']
+        progress = post.setdefault('publish_progress', [])
+        for i, (kind, value, caption) in enumerate(publish_steps(post)):
+            if i < len(progress):
+                continue
+            if kind == "photo":
+                message = await bot.send_photo(channel_id, value)
+            elif kind == "video":
+                message = await bot.send_video(channel_id, value)
+            elif kind == "message":
+                message = await bot.send_message(channel_id, value)
+            else:
+                message = await bot.send_document(channel_id, value, caption=caption)
+            db.record_progress(post, kind, message.message_id)
+        
+        post.pop('publish_error', None)
+        post['status'] = 'published'
+        return True
+    finally:
+        publishing_now.discard(post['id'])
+
+async def notify_published(post):
+    channel = db.get_channel(post['channel'])
+    channel_name = channel.get('title', post['channel']) if channel else post['channel']
+    try:
+        await notifier.post_published(post, channel_name)
+    except Exception as e:
+        logger.error("Ошибка уведомления о публикации: %s", e, extra={"category": "publish", "post_id": post["id"]})
+
+# Флуд-контроль, сеть и 5xx проходят сами: такие сбои не тратят попытки PUBLISH_MAX_ATTEMPTS
+TRANSIENT_ERRORS = (TelegramRetryAfter, TelegramNetworkError, TelegramServerError)
+
+def record_publish_error(post, error):
+    if not isinstance(error, TRANSIENT_ERRORS):
+        post['publish_attempts'] = post.get('publish_attempts', 0) + 1
+    post['publish_error'] = str(error)
+    db.save()
+    logger.error("Ошибка публикации: %s", error, extra={"category": "publish", "post_id": post["id"]})
+
+async def notify_given_up(post):
+    """Планировщик больше не трогает пост - админ узнаёт об этом сразу, а не из /repair"""
+    try:
+        await bot.send_message(
+            moderators.admin_id,
+            f"⚠️ Пост #{post['id']} не опубликован за {PUBLISH_MAX_ATTEMPTS} попыток: {post['publish_error'][:200]}\n"
+            f"Допубликовать: /repair"
+        )
+    except Exception as e:
+        logger.error("Ошибка уведомления о неудачной публикации: %s", e, extra={"category": "publish", "post_id": post["id"]})
+
+async def publish_due(now):
+    """Один проход планировщика: публикует одобренные посты, время которых наступило"""
+    published = []
+    for post in list(db.posts):
+        if (post['status'] == 'approved' and post.get('scheduled_time') and post.get('channel')
+                and post.get('publish_attempts', 0) < PUBLISH_MAX_ATTEMPTS):
+            try:
+                if datetime.fromisoformat(post['scheduled_time']) > now:
+                    continue
+                if not await publish_post(post):
+                    continue
+            except Exception as e:
+                record_publish_error(post, e)
+                if post.get('publish_attempts', 0) >= PUBLISH_MAX_ATTEMPTS:
+                    await notify_given_up(post)
+                continue
+            published.append(post)
+            await notify_published(post)
+    # Все опубликованные за тик уходят в архив разом
+    db.archive_posts(published)
+    return published
+
+async def scheduler_tick(now):
+    """Всё, что планировщик делает раз в минуту"""
+    await requeue_expired(now)
+    return await publish_due(now)
+
 async def publish_scheduled():
     while True:
-        await asyncio.sleep(60)
-        try:
-            now = datetime.now()
-            for post in db.posts:
-                if post['status'] == 'approved' and post.get('scheduled_time'):
-                    try:
-                        if datetime.fromisoformat(post['scheduled_time']) <= now:
-                            channel_id = post.get('channel')
-                            if channel_id:
-                                content = post['content']
-                                for photo_id in content.get('photos', []):
-                                    await bot.send_photo(channel_id, photo_id)
-                                for video_id in content.get('videos', []):
-                                    await bot.send_video(channel_id, video_id)
-                                await bot.send_message(channel_id, f"✍️ Автор: @{post['username']}")
-                                
-                                if content['type'] == 'livery':
-                                    if content['files'].get('body'):
-                                        await bot.send_document(channel_id, content['files']['body']['file_id'], caption="📁 Кузов")
-                                    if content['files'].get('glass'):
-                                        await bot.send_document(channel_id, content['files']['glass']['file_id'], caption="📁 Стекло")
-                                elif content['type'] == 'sticker' and content['files'].get('sticker'):
-                                    await bot.send_document(channel_id, content['files']['sticker']['file_id'], caption="🏷️ Наклейка")
-                                
-                                post['status'] = 'published'
-                                db.save()
-                                
-                                channel = db.get_current_channel()
-                                channel_name = channel.get('title', channel_id) if channel else channel_id
-                                await bot.send_message(ADMIN_ID, f"✅ Пост #{post['id']} опубликован в {channel_name}")
-                    except Exception as e:
-                        logger.error(f"Ошибка публикации: {e}")
-        except Exception as e:
-            logger.error(f"Ошибка в планировщике: {e}")
+        await clock.sleep(60)
+        for tenant in tenants:
+            with use_tenant(tenant):
+                try:
+                    await profiler.run("scheduler_tick", scheduler_tick, clock.now())
+                except Exception as e:
+                    logger.exception("Ошибка в планировщике: %s", e, extra={"category": "publish"})
+        report_dropped()
 
 # ==================== ЗАПУСК ====================
 async def main():
-    await bot.delete_webhook(drop_pending_updates=True)
+    for tenant in tenants:
+        await tenant.bot.delete_webhook(drop_pending_updates=True)
     asyncio.create_task(publish_scheduled())
-    await dp.start_polling(bot)
+    try:
+        await dp.start_polling(*(tenant.bot for tenant in tenants))
+    finally:
+        for tenant in tenants:
+            with use_tenant(tenant):
+                await notifier.flush()
+        report_dropped()
 
 if __name__ == "__main__":
     asyncio.run(main())
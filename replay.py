@@ -0,0 +1,306 @@
+"""
+Воспроизведение записанной трассы апдейтов (TRACE_FILE) на настоящих обработчиках.
+
+Бот работает против локального фейкового Bot API, время планировщика идёт
+по виртуальным часам из трассы. В конце печатается отчёт о расхождениях
+(другие вызовы Bot API, ошибки) и распределение задержек.
+
+    python replay.py trace.jsonl.1 trace.jsonl --speed 10
+    python replay.py trace.jsonl --speed max --state ./backup
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import zlib
+from datetime import datetime, timedelta
+
+from aiohttp import web
+
+# Всё, что SimpleDB читает при старте: горячие посты, каналы, архив с индексом и журнал повторов
+STATE_FILES = ("posts.json", "channels.json", "archive.jsonl", "archive.idx", "media.idx", "publish.idx")
+
+# ==================== ФЕЙКОВЫЙ BOT API ====================
+class FakeBotAPI:
+    """Отвечает на любые методы Bot API правдоподобными результатами"""
+    def __init__(self):
+        self.message_id = 0
+        self.calls = 0
+        self.app = web.Application()
+        self.app.router.add_post("/bot{token}/{method}", self.handle)
+        self.app.router.add_get("/file/bot{token}/{path:.+}", self.handle_file)
+        self.runner = None
+        self.url = None
+
+    async def start(self):
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        params = dict(await request.post())
+        self.calls += 1
+        return web.json_response({"ok": True, "result": self.result(method, params)})
+
+    async def handle_file(self, request):
+        # Для проверки .txt-файлов достаточно любого текста
+        return web.Response(body=f"replay {request.match_info['path']}\n".encode())
+
+    def chat_id(self, value):
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            return -1000000000000 - zlib.crc32(str(value).encode())
+
+    def result(self, method, params):
+        chat_id = self.chat_id(params.get("chat_id", 1))
+        chat = {"id": chat_id, "type": "private" if chat_id > 0 else "channel", "title": str(params.get("chat_id"))}
+        if method.startswith(("send", "edit", "copy", "forward")) and method != "sendChatAction":
+            self.message_id += 1
+            message = {"message_id": int(params.get("message_id", self.message_id)), "date": int(time.time()), "chat": chat}
+            if params.get("text"):
+                message["text"] = params["text"]
+            return message
+        if method == "getChat":
+            return chat
+        if method == "getFile":
+            file_id = params.get("file_id", "file")
+            return {"file_id": file_id, "file_unique_id": file_id, "file_size": 64, "file_path": f"documents/{file_id}.txt"}
+        if method == "getMe":
+            return {"id": 1, "is_bot": True, "first_name": "replay", "username": "replay_bot"}
+        return True
+
+# ==================== ВОСПРОИЗВЕДЕНИЕ ====================
+class VirtualClock:
+    """Часы, которые двигает replay по отметкам времени из трассы.
+    sleep() ждёт, пока виртуальное время дойдёт до нужной отметки (например, окно сводки)"""
+    def __init__(self, start):
+        self.current = start
+        self.sleepers = []
+
+    def now(self):
+        return self.current
+
+    def advance(self, now):
+        self.current = now
+        for wake_at, future in self.sleepers:
+            if wake_at <= now and not future.done():
+                future.set_result(None)
+        self.sleepers = [(wake_at, future) for wake_at, future in self.sleepers if not future.done()]
+
+    async def sleep(self, seconds):
+        future = asyncio.get_running_loop().create_future()
+        self.sleepers.append((self.current + timedelta(seconds=seconds), future))
+        await future
+
+def read_trace(paths):
+    records = []
+    for path in paths:
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                line = line.strip()
+                if line:
+                    records.append(json.loads(line))
+    # Записи попадают в файл по завершении обработки, порядок прихода - по ts
+    records.sort(key=lambda record: record["ts"])
+    return records
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def update_kind(update):
+    for key in update:
+        if key != "update_id":
+            return key
+    return "unknown"
+
+async def tick_all(app, now):
+    """Тик планировщика для каждого бота, как в publish_scheduled"""
+    for tenant in app.tenants:
+        with app.use_tenant(tenant):
+            await app.scheduler_tick(now)
+
+def load_state(app, state):
+    """Копирует файлы базы каждого бота из state/<DATA_DIR> и перечитывает базу"""
+    for tenant in app.tenants:
+        source = os.path.join(state, tenant.data_dir)
+        for name in STATE_FILES:
+            if os.path.exists(os.path.join(source, name)):
+                shutil.copy(os.path.join(source, name), tenant.data_dir)
+        tenant.db = app.SimpleDB(tenant.data_dir)
+
+async def replay(records, speed, app):
+    from aiogram.types import Update
+
+    results = []
+    bots = {tenant.bot.id: tenant.bot for tenant in app.tenants}
+
+    def bot_for(record):
+        """Бот, которому пришёл апдейт. С одним ботом трасса идёт ему,
+        даже если токен для воспроизведения другой (или в старой трассе нет поля bot)"""
+        if record.get("bot") in bots:
+            return bots[record["bot"]]
+        if len(bots) == 1:
+            return app.tenants[0].bot
+        return None
+
+    async def run_one(record):
+        bot = bot_for(record)
+        calls = []
+        token = app.current_calls.set(calls)
+        error = None
+        started = time.perf_counter()
+        try:
+            if bot is None:
+                raise LookupError(f"бота {record.get('bot')} нет в TENANTS")
+            update = Update.model_validate(record["update"], context={"bot": bot})
+            response = await app.dp.feed_update(bot, update)
+            handled = response is not app.UNHANDLED
+        except Exception as e:
+            handled = True
+            error = repr(e)
+        finally:
+            app.current_calls.reset(token)
+        results.append({
+            "record": record,
+            "kind": update_kind(record["update"]),
+            "handled": handled,
+            "calls": calls,
+            "error": error,
+            "latency": time.perf_counter() - started
+        })
+
+    start = datetime.fromisoformat(records[0].get("clock") or datetime.fromtimestamp(records[0]["ts"]).isoformat())
+    app.clock = VirtualClock(start)
+    next_tick = start + timedelta(seconds=60)
+    first_ts = records[0]["ts"]
+    wall_start = time.perf_counter()
+    tasks = []
+    ticks = 0
+
+    for record in records:
+        offset = record["ts"] - first_ts
+        virtual_now = start + timedelta(seconds=offset)
+
+        # Тики планировщика, пропущенные между апдейтами
+        while next_tick <= virtual_now:
+            app.clock.advance(next_tick)
+            await tick_all(app, next_tick)
+            ticks += 1
+            next_tick += timedelta(seconds=60)
+        app.clock.advance(virtual_now)
+        # Дать проснуться задачам, чьё время наступило (сводки), до следующего апдейта
+        await asyncio.sleep(0)
+
+        if speed:
+            delay = offset / speed - (time.perf_counter() - wall_start)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(run_one(record)))
+        else:
+            await run_one(record)
+
+    if tasks:
+        await asyncio.gather(*tasks)
+    app.clock.advance(next_tick)
+    await tick_all(app, next_tick)
+    ticks += 1
+    for tenant in app.tenants:
+        with app.use_tenant(tenant):
+            await app.notifier.flush()
+    return results, ticks, time.perf_counter() - wall_start
+
+def report(results, ticks, elapsed, api_calls):
+    divergences = []
+    for r in results:
+        rec = r["record"]
+        reasons = []
+        if r["handled"] != rec.get("handled", True):
+            reasons.append(f"handled {rec.get('handled')} -> {r['handled']}")
+        if r["calls"] != rec.get("calls", []):
+            reasons.append(f"calls {rec.get('calls')} -> {r['calls']}")
+        if r["error"] and r["error"] != rec.get("error"):
+            reasons.append(f"error {r['error']}")
+        if reasons:
+            divergences.append((rec["update"].get("update_id"), reasons))
+
+    print(f"Апдейтов: {len(results)}, тиков планировщика: {ticks}, вызовов API: {api_calls}, время: {elapsed:.2f} с")
+    print(f"Расхождений: {len(divergences)}")
+    for update_id, reasons in divergences[:20]:
+        print(f"  update {update_id}: {'; '.join(reasons)}")
+
+    kinds = {}
+    for r in results:
+        kinds.setdefault(r["kind"], []).append(r["latency"])
+    kinds["всего"] = [r["latency"] for r in results]
+    print(f"{'тип':<16}{'n':>8}{'p50 мс':>10}{'p90 мс':>10}{'p99 мс':>10}{'max мс':>10}")
+    for kind, values in kinds.items():
+        print(f"{kind:<16}{len(values):>8}" + "".join(f"{percentile(values, q) * 1000:>10.1f}" for q in (0.5, 0.9, 0.99, 1.0)))
+    return divergences
+
+async def main():
+    parser = argparse.ArgumentParser(description="Воспроизведение трассы апдейтов")
+    parser.add_argument("trace", nargs="+", help="файлы трассы в хронологическом порядке")
+    parser.add_argument("--speed", default="1", help="множитель скорости: 1, 10, ... или max")
+    parser.add_argument("--state", help="папка с файлами базы (posts.json, channels.json, архив, media.idx, publish.idx) для начального состояния; "
+                                        "при нескольких ботах - с подпапками их DATA_DIR")
+    parser.add_argument("--workdir", help="рабочая папка (по умолчанию временная)")
+    args = parser.parse_args()
+
+    speed = 0 if args.speed == "max" else float(args.speed)
+    records = read_trace(args.trace)
+    if not records:
+        print("Трасса пуста")
+        return 0
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix="replay_")
+    os.makedirs(workdir, exist_ok=True)
+    state = os.path.abspath(args.state) if args.state else None
+
+    # bot.py читает базу из текущей папки при импорте
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ["TRACE_FILE"] = ""
+    os.environ.setdefault("BOT_TOKEN", "123456:offline")
+    os.environ["CONFIG_FILE"] = os.path.abspath(os.getenv("CONFIG_FILE", "config.json"))
+    # Без ADMIN_ID bot.py не стартует; id из config.json не перекрываем, он нужен для трасс с настоящим админом
+    if "ADMIN_ID" not in os.environ and not os.path.exists(os.environ["CONFIG_FILE"]):
+        os.environ["ADMIN_ID"] = "1"
+    os.chdir(workdir)
+    import bot as app
+    from aiogram.client.telegram import TelegramAPIServer
+
+    if any(os.path.isabs(tenant.data_dir) for tenant in app.tenants):
+        sys.exit("DATA_DIR задан абсолютным путём: replay записал бы в настоящую базу")
+    if state:
+        load_state(app, state)
+
+    api = FakeBotAPI()
+    await api.start()
+    app.session.api = TelegramAPIServer.from_base(api.url)
+    try:
+        results, ticks, elapsed = await replay(records, speed, app)
+    finally:
+        await app.session.close()
+        await api.stop()
+
+    divergences = report(results, ticks, elapsed, api.calls)
+    print(f"Состояние после воспроизведения: {workdir}")
+    return 1 if divergences else 0
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
@@ -0,0 +1,187 @@
+"""
+Симуляция планировщика публикаций на виртуальных часах.
+
+Загружает в память N одобренных постов со случайным scheduled_time по многим
+каналам и прогоняет тики планировщика без реального ожидания и без сети.
+Печатает CPU на тик, задержку публикации относительно scheduled_time и память.
+
+    python simulate.py --posts 100000 --channels 200 --hours 2
+    python simulate.py --posts 1000000 --scheduler mymodule:publish_due
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+# ==================== ЗАГЛУШКИ ====================
+class CountingBot:
+    """Бот без сети: только считает вызовы отправки"""
+    def __init__(self):
+        self.calls = 0
+
+    async def _send(self, *args, **kwargs):
+        self.calls += 1
+        return SimpleNamespace(message_id=self.calls)
+
+    send_photo = send_video = send_message = send_document = _send
+
+class SimClock:
+    """Время двигает только цикл симуляции; sleep() ждёт нужной отметки (например, окно сводки)"""
+    def __init__(self, start):
+        self.current = start
+        self.sleepers = []
+
+    def now(self):
+        return self.current
+
+    def advance(self, seconds):
+        self.current += timedelta(seconds=seconds)
+        for wake_at, future in self.sleepers:
+            if wake_at <= self.current and not future.done():
+                future.set_result(None)
+        self.sleepers = [(wake_at, future) for wake_at, future in self.sleepers if not future.done()]
+
+    async def sleep(self, seconds):
+        future = asyncio.get_running_loop().create_future()
+        self.sleepers.append((self.current + timedelta(seconds=seconds), future))
+        await future
+
+def memory_db(app):
+    """SimpleDB без диска: save() и запись в архив только считаются, чтобы не писать миллион постов на каждый тик"""
+    class MemoryDB(app.SimpleDB):
+        def __init__(self):
+            self.saves = 0
+            self.archived = 0
+            super().__init__()
+
+        def load(self):
+            self.posts = []
+            self.channels = []
+            self.current_channel = None
+
+        def save(self):
+            self.saves += 1
+
+        def _append_archive(self, posts):
+            self.archived += len(posts)
+
+        def _append_progress(self, line):
+            pass
+
+    return MemoryDB()
+
+# ==================== ДАННЫЕ ====================
+def generate(db, posts, channels, start, hours, seed):
+    rnd = random.Random(seed)
+    channel_ids = [f"@sim_channel_{i}" for i in range(channels)]
+    db.channels = [{"id": ch, "title": ch} for ch in channel_ids]
+    db.current_channel = channel_ids[0]
+    horizon = hours * 3600
+    kinds = ("regular", "livery", "sticker")
+    for i in range(1, posts + 1):
+        kind = rnd.choice(kinds)
+        content = {"type": kind, "photos": [f"photo_{i}"]}
+        if kind == "regular":
+            content["videos"] = []
+        elif kind == "livery":
+            content["files"] = {"body": {"file_id": f"body_{i}", "file_name": "body.txt"},
+                                "glass": {"file_id": f"glass_{i}", "file_name": "glass.txt"}}
+        else:
+            content["files"] = {"sticker": {"file_id": f"sticker_{i}", "file_name": "sticker.txt"}}
+        db.posts.append({
+            "id": i,
+            "user_id": rnd.randrange(1, 10 ** 6),
+            "username": f"user{i}",
+            "content": content,
+            "status": "approved",
+            "created_at": start.isoformat(),
+            "channel": rnd.choice(channel_ids),
+            # часть постов лежит за горизонтом и не должна публиковаться
+            "scheduled_time": (start + timedelta(seconds=rnd.uniform(0, horizon * 1.5))).isoformat()
+        })
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+def rss_mb():
+    # ru_maxrss в килобайтах на Linux и в байтах на macOS
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage / (1024 * 1024) if sys.platform == "darwin" else usage / 1024
+
+# ==================== СИМУЛЯЦИЯ ====================
+async def simulate(app, scheduler, args):
+    start = datetime(2026, 1, 1, 9, 0)
+    app.clock = SimClock(start)
+    app.bot = CountingBot()
+    app.db = memory_db(app)
+
+    rss_before = rss_mb()
+    load_started = time.perf_counter()
+    generate(app.db, args.posts, args.channels, start, args.hours, args.seed)
+    load_time = time.perf_counter() - load_started
+    rss_loaded = rss_mb()
+    sample = json.dumps(app.db.posts[:1000])
+    bytes_per_post = len(sample) / min(1000, max(1, len(app.db.posts)))
+
+    tick_cpu = []
+    lags = []
+    published_total = 0
+    wall_started = time.perf_counter()
+    for _ in range(int(args.hours * 60)):
+        app.clock.advance(60)
+        await asyncio.sleep(0)
+        now = app.clock.now()
+        cpu_started = time.process_time()
+        published = await scheduler(now) or []
+        tick_cpu.append(time.process_time() - cpu_started)
+        published_total += len(published)
+        for post in published:
+            lags.append((now - datetime.fromisoformat(post["scheduled_time"])).total_seconds())
+    wall = time.perf_counter() - wall_started
+
+    print(f"Постов: {args.posts}, каналов: {args.channels}, тиков: {len(tick_cpu)} ({args.hours} ч виртуального времени)")
+    print(f"Загрузка: {load_time:.2f} с, память: {rss_before:.0f} -> {rss_loaded:.0f} МБ (пик после прогона {rss_mb():.0f} МБ)")
+    print(f"Прогон: {wall:.2f} с реального времени, опубликовано: {published_total}, вызовов API: {app.bot.calls}")
+    print(f"CPU на тик, мс: среднее {sum(tick_cpu) / max(1, len(tick_cpu)) * 1000:.1f}, "
+          f"p50 {percentile(tick_cpu, 0.5) * 1000:.1f}, p99 {percentile(tick_cpu, 0.99) * 1000:.1f}, "
+          f"max {max(tick_cpu, default=0) * 1000:.1f}")
+    print(f"Задержка публикации, с: p50 {percentile(lags, 0.5):.1f}, p99 {percentile(lags, 0.99):.1f}, max {max(lags, default=0):.1f}")
+    saves = getattr(app.db, "saves", 0)
+    print(f"Сохранений базы: {saves} (~{saves * bytes_per_post * len(app.db.posts) / 1024 / 1024:.0f} МБ записи на диск в бою)")
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция планировщика на виртуальных часах")
+    parser.add_argument("--posts", type=int, default=10000)
+    parser.add_argument("--channels", type=int, default=50)
+    parser.add_argument("--hours", type=float, default=2, help="длительность виртуального прогона")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--scheduler", default="bot:publish_due",
+                        help="функция одного тика планировщика module:function, принимает now")
+    args = parser.parse_args()
+
+    # bot.py читает базу из текущей папки при импорте
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    os.environ["TRACE_FILE"] = ""
+    os.environ.setdefault("BOT_TOKEN", "123456:offline")
+    os.environ.setdefault("ADMIN_ID", "1")
+    os.environ["CONFIG_FILE"] = os.path.abspath(os.getenv("CONFIG_FILE", "config.json"))
+    os.chdir(tempfile.mkdtemp(prefix="simulate_"))
+    import bot as app
+
+    module_name, func_name = args.scheduler.split(":")
+    scheduler = getattr(importlib.import_module(module_name), func_name)
+    asyncio.run(simulate(app, scheduler, args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,34 @@
+"""Импорт bot.py без сети и без файлов базы в рабочей папке"""
+import os
+import sys
+import tempfile
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+@pytest.fixture(scope="session")
+def app():
+    os.environ.update(
+        BOT_TOKEN="123456:test",
+        ADMIN_ID="1",
+        TRACE_FILE="",
+        CONFIG_FILE=os.path.join(tempfile.mkdtemp(prefix="bot_test_"), "config.json")
+    )
+    # bot.py создаёт базу первого бота в текущей папке при импорте
+    cwd = os.getcwd()
+    os.chdir(tempfile.mkdtemp(prefix="bot_test_"))
+    try:
+        import bot
+    finally:
+        os.chdir(cwd)
+    return bot
+
+@pytest.fixture
+def data_dir(tmp_path):
+    return str(tmp_path)
+
+@pytest.fixture
+def db(app, data_dir):
+    return app.SimpleDB(data_dir)
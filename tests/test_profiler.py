@@ -0,0 +1,44 @@
+"""Профилировщик: обёртки SimpleDB снимаются до следующего /profile"""
+import asyncio
+
+def test_restart_before_report_keeps_db_unwrapped(app, db, monkeypatch):
+    originals = dict(vars(app.SimpleDB))
+    profiler = app.Profiler(1.0)
+    sent = []
+    
+    async def send_report(*args):
+        sent.append(args)
+    
+    monkeypatch.setattr(profiler, "send_report", send_report)
+    
+    async def handler():
+        db.save()
+    
+    async def scenario():
+        profiler.start(1, updates=1)
+        await profiler.run("handler", handler, update=True)
+        # Отчёт ещё не отправлен, а новый /profile уже пришёл
+        profiler.start(1, updates=1)
+        await profiler.run("handler", handler, update=True)
+        await asyncio.sleep(0)
+    
+    asyncio.run(scenario())
+    assert len(sent) == 2
+    assert dict(vars(app.SimpleDB)) == originals
+    
+    stats = sent[0][0]
+    assert stats["db.save"][0] == 1
+    assert stats["db.*"][1] == stats["db.save"][1]
+
+def test_db_total_counts_nested_calls_once(app, db):
+    profiler = app.Profiler(1.0)
+    profiler.start(1)
+    try:
+        post = db.get_post(db.add_post(1000, "author", {"type": "regular", "photos": []}))
+        profiler.stats = {}
+        db.archive_post(post)
+    finally:
+        stats, *_ = profiler.stop()
+    assert {"db.archive_post", "db.archive_posts", "db.save"} <= set(stats)
+    assert stats["db.*"][0] == 1
+    assert stats["db.*"][1] == stats["db.archive_post"][1]
@@ -0,0 +1,86 @@
+"""Публикация по шагам: повтор после сбоя продолжает с незавершённого шага"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+import pytest
+
+class FlakyBot:
+    """Отвечает как Bot API, но падает на шаге номер fail_at (с нуля)"""
+    def __init__(self, fail_at=None):
+        self.fail_at = fail_at
+        self.sent = []
+    
+    async def _send(self, kind, value):
+        if len(self.sent) == self.fail_at:
+            self.fail_at = None
+            raise RuntimeError("bad request")
+        self.sent.append((kind, value))
+        return SimpleNamespace(message_id=100 + len(self.sent))
+    
+    async def send_photo(self, chat_id, photo):
+        return await self._send("photo", photo)
+    
+    async def send_video(self, chat_id, video):
+        return await self._send("video", video)
+    
+    async def send_message(self, chat_id, text):
+        return await self._send("message", text)
+    
+    async def send_document(self, chat_id, document, caption=None):
+        return await self._send("document", document)
+
+@pytest.fixture
+def tenant(app, db, monkeypatch):
+    tenant = app.tenants[0]
+    monkeypatch.setattr(tenant, "db", db)
+    with app.use_tenant(tenant):
+        yield tenant
+
+def approved_post(db):
+    post_id = db.add_post(1000, "author", {"type": "regular", "photos": ["p1", "p2"], "videos": ["v1"]})
+    post = db.get_post(post_id)
+    post["status"] = "approved"
+    post["channel"] = "@channel"
+    db.save()
+    return post
+
+def test_resume_after_failure(app, db, data_dir, tenant, monkeypatch):
+    post = approved_post(db)
+    monkeypatch.setattr(tenant, "bot", FlakyBot(fail_at=2))
+    with pytest.raises(RuntimeError):
+        asyncio.run(app.publish_post(post))
+    assert [step["step"] for step in post["publish_progress"]] == ["photo", "photo"]
+    
+    # Шаги не попали в posts.json, но переживают перезапуск через журнал
+    assert os.path.exists(db.PROGRESS_FILE)
+    reloaded = app.SimpleDB(data_dir)
+    assert reloaded.get_post(post["id"])["publish_progress"] == post["publish_progress"]
+    
+    monkeypatch.setattr(tenant, "db", reloaded)
+    retry = FlakyBot()
+    monkeypatch.setattr(tenant, "bot", retry)
+    post = reloaded.get_post(post["id"])
+    assert asyncio.run(app.publish_post(post)) is True
+    assert retry.sent == [("video", "v1"), ("message", "✍️ Автор: @author")]
+    assert len(post["publish_progress"]) == 4
+    assert post["status"] == "published"
+    
+    # save() переносит шаги в posts.json и сбрасывает журнал
+    reloaded.archive_posts([post])
+    assert not os.path.exists(reloaded.PROGRESS_FILE)
+    assert reloaded.get_archived_post(post["id"])["publish_progress"] == post["publish_progress"]
+
+def test_progress_journal_is_idempotent(app, db, data_dir):
+    post = approved_post(db)
+    db.record_progress(post, "photo", 11)
+    # Строку, уже учтённую в posts.json, повторное чтение журнала не дублирует
+    db.save()
+    db._append_progress(f"{post['id']}\t0\tphoto\t11\n")
+    db._append_progress(f"{post['id']}\t1\tphoto\t12\n")
+    db._append_progress(f"{post['id']}\t2\tvid")
+    reloaded = app.SimpleDB(data_dir)
+    assert reloaded.get_post(post["id"])["publish_progress"] == [
+        {"step": "photo", "message_id": 11},
+        {"step": "photo", "message_id": 12},
+    ]
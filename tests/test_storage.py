@@ -0,0 +1,91 @@
+"""Форматы файлов, которые SimpleDB разбирает при старте: журнал media.idx и индекс archive.idx"""
+import os
+from datetime import datetime, timedelta
+
+START = datetime(2026, 1, 1, 9, 0)
+
+def add_posts(db, count, media_per_post=2):
+    posts = []
+    for i in range(count):
+        unique_ids = [f"u{i}_{j}" for j in range(media_per_post)]
+        post_id = db.add_post(1000 + i, f"user{i}", {"type": "regular", "photos": [], "unique_ids": unique_ids})
+        post = db.get_post(post_id)
+        post["created_at"] = (START + timedelta(minutes=i)).isoformat()
+        posts.append(post)
+    return posts
+
+def media_lines(db):
+    with open(db.MEDIA_FILE) as f:
+        return [line.rstrip("\n").split("\t") for line in f]
+
+def test_media_journal_survives_reload(app, db, data_dir):
+    posts = add_posts(db, 5)
+    db.add_post(2000, "again", {"type": "regular", "photos": [], "unique_ids": ["u1_0", "u3_1"]})
+    db.delete_post(posts[0]["id"])
+    
+    assert media_lines(db)[-1] == ["-", str(posts[0]["id"])]
+    reloaded = app.SimpleDB(data_dir)
+    assert reloaded._get_media() == db._get_media()
+    assert reloaded._media_posts == db._media_posts
+    assert reloaded.find_duplicates(["u0_0", "u0_1"]) == {}
+    assert reloaded.find_duplicates(["u1_0", "u3_1"]) == {posts[1]["id"]: 1, posts[3]["id"]: 1, 6: 2}
+
+def test_exact_duplicate_needs_same_files(app, db):
+    db.add_post(1, "a", {"type": "regular", "photos": [], "unique_ids": ["A", "B", "C"]})
+    db.add_post(2, "b", {"type": "regular", "photos": [], "unique_ids": ["C", "B", "A"]})
+    
+    # Часть файлов старого поста - только пометка, не точный повтор
+    subset = db.find_duplicates(["A"])
+    assert subset == {1: 1, 2: 1}
+    assert db.exact_duplicates(["A"], subset) == []
+    superset = db.find_duplicates(["A", "B", "C", "D"])
+    assert db.exact_duplicates(["A", "B", "C", "D"], superset) == []
+    same = db.find_duplicates(["B", "A", "C", "A"])
+    assert sorted(db.exact_duplicates(["B", "A", "C", "A"], same)) == [1, 2]
+
+def test_media_journal_compaction(app, db, data_dir):
+    posts = add_posts(db, 150)
+    cutoff = START + timedelta(minutes=119)
+    assert db.prune_posts(cutoff) == 120
+    
+    # Больше 100 удалений за раз - журнал переписан без строк "-"
+    lines = media_lines(db)
+    assert all(op == "+" for op, *_ in lines)
+    assert [int(post_id) for _, post_id, *_ in lines] == [p["id"] for p in posts[120:]]
+    
+    reloaded = app.SimpleDB(data_dir)
+    reloaded._get_media()
+    assert reloaded._media_posts == {p["id"]: p["content"]["unique_ids"] for p in posts[120:]}
+    assert reloaded.find_duplicates(["u0_0"]) == {}
+    assert reloaded.find_duplicates(["u149_0", "u149_1"]) == {posts[149]["id"]: 2}
+
+def test_prune_archive_round_trip(app, db, data_dir):
+    posts = add_posts(db, 6)
+    db.archive_posts(posts[:4])
+    db.archive_post(posts[4])
+    assert [p["id"] for p in db.posts] == [posts[5]["id"]]
+    
+    cutoff = START + timedelta(minutes=1)
+    assert db.prune_archive(cutoff) == 2
+    assert db.archived_count() == 3
+    assert db.get_archived_post(posts[0]["id"]) is None
+    for post in posts[2:5]:
+        assert db.get_archived_post(post["id"]) == post
+    # Медиа удалённых из архива постов больше не считаются повторами
+    assert db.find_duplicates(["u1_0"]) == {}
+    assert db.find_duplicates(["u2_0"]) == {posts[2]["id"]: 1}
+    
+    reloaded = app.SimpleDB(data_dir)
+    assert reloaded._get_index() == db._get_index()
+    assert reloaded.get_archived_post(posts[4]["id"]) == posts[4]
+    assert reloaded.next_id == posts[5]["id"] + 1
+
+def test_archive_index_rebuilt_from_archive(app, db, data_dir):
+    posts = add_posts(db, 3)
+    db.archive_posts(posts)
+    index = dict(db._get_index())
+    
+    os.remove(db.INDEX_FILE)
+    reloaded = app.SimpleDB(data_dir)
+    assert reloaded._get_index() == index
+    assert [reloaded.get_archived_post(p["id"]) for p in posts] == posts